@@ -1,428 +1,2199 @@
-import socket
-import re
-import time
-import threading
-from queue import Queue
-from datetime import datetime
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
-# Cloudflare节点测试配置参数
-TEST_TIMEOUT = 3  # 测试超时时间(秒)
-TEST_PORT = 443   # 测试端口
-MAX_THREADS = 30  # 最大线程数
-TOP_NODES = 100    # 显示和保存前N个最快节点
-TXT_OUTPUT_FILE = "IP.txt"    # TXT结果保存文件
-
-# 国家代码到中文国家名称的映射
-COUNTRY_CODES = {
-    'US': '美国',
-    'CN': '中国',
-    'JP': '日本',
-    'SG': '新加坡',
-    'KR': '韩国',
-    'GB': '英国',
-    'FR': '法国',
-    'DE': '德国',
-    'AU': '澳大利亚',
-    'CA': '加拿大',
-    'HK': '中国香港',
-    'TW': '中国台湾',
-    'IN': '印度',
-    'RU': '俄罗斯',
-    'BR': '巴西',
-    'MX': '墨西哥',
-    'NL': '荷兰',
-    'SE': '瑞典',
-    'CH': '瑞士',
-    'IT': '意大利',
-    'ES': '西班牙',
-    'Unknown': '未知'
-}
-
-# IP地理位置查询函数
-def get_ip_country(ip):
-    """获取IP地址对应的国家信息(返回中文)"""
-    try:
-        # 验证IP格式
-        socket.inet_aton(ip)
-        
-        # 创建会话并配置重试机制
-        import requests
-        session = requests.Session()
-        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        
-        # 尝试使用ipwhois.app API (不需要API密钥)
-        try:
-            url = f"https://ipwhois.app/json/{ip}"
-            response = session.get(url, timeout=15)
-            if response.status_code == 200:
-                data = response.json()
-                if 'country' in data and data['country']:
-                    country = data['country']
-                    # 转换国家名称为中文
-                    if country == 'United States':
-                        return '美国'
-                    elif country == 'China':
-                        return '中国'
-                    elif country == 'Japan':
-                        return '日本'
-                    elif country == 'Singapore':
-                        return '新加坡'
-                    elif country == 'South Korea':
-                        return '韩国'
-                    elif country == 'United Kingdom':
-                        return '英国'
-                    elif country == 'France':
-                        return '法国'
-                    elif country == 'Germany':
-                        return '德国'
-                    elif country == 'Australia':
-                        return '澳大利亚'
-                    elif country == 'Canada':
-                        return '加拿大'
-                    elif country == 'Hong Kong':
-                        return '中国香港'
-                    elif country == 'Taiwan':
-                        return '中国台湾'
-                    # 如果是国家代码，尝试从映射中获取中文名称
-                    elif len(country) == 2:
-                        return COUNTRY_CODES.get(country, country)
-                    return country
-        except Exception as e:
-            print(f"ipwhois.app错误 {ip}: {str(e)}")
-        
-        # 尝试使用ip-api.com的备用端点 (使用HTTP而非HTTPS)
-        try:
-            url = f"http://ip-api.com/json/{ip}?fields=countryCode"
-            response = session.get(url, timeout=15)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('status') == 'success' and 'countryCode' in data:
-                    country_code = data['countryCode']
-                    # 从映射中获取中文国家名称
-                    return COUNTRY_CODES.get(country_code, country_code)
-        except Exception as e:
-            print(f"ip-api.com错误 {ip}: {str(e)}")
-        
-        # 基于IP地址范围的简单判断 (Cloudflare IP范围)
-        # 这些IP看起来是Cloudflare的IP地址
-        octets = ip.split('.')
-        if octets[0] == '104' and octets[1] == '18':
-            return '美国'  # Cloudflare US IPs
-        elif octets[0] == '108' and octets[1] == '162':
-            return '美国'  # Cloudflare US IPs
-        elif octets[0] == '162' and octets[1] == '159':
-            return '美国'  # Cloudflare US IPs
-        elif octets[0] == '172' and octets[1] == '64':
-            return '美国'  # Cloudflare US IPs
-        
-        return '未知'
-    except Exception as e:
-        print(f"IP验证错误 {ip}: {str(e)}")
-        return '未知'
-
-def clean_ip(ip_str):
-    """清理IP字符串，移除可能的冒号或其他字符"""
-    # 移除末尾的冒号和空格
-    ip_str = ip_str.strip().rstrip(':')
-    # 验证是否为有效的IPv4地址
-    pattern = r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$'
-    if re.match(pattern, ip_str):
-        # 进一步验证每个数字是否在0-255范围内
-        parts = ip_str.split('.')
-        if all(0 <= int(part) <= 255 for part in parts):
-            return ip_str
-    return None
-
-# Cloudflare节点测试类
-class CloudflareNodeTester:
-    def __init__(self):
-        self.nodes = set()  # 存储节点IP，使用set避免重复
-        self.results = []   # 存储测试结果
-        self.lock = threading.Lock()
-    
-    def fetch_known_nodes(self):
-        """从公开来源获取已知的Cloudflare节点IP"""
-
-        
-        # 常见的Cloudflare IP段
-        ip_ranges = [
-"172.64.229.0/24",
-"104.16.0.0/24",
-"104.17.0.0/24",
-"104.18.0.0/24",
-"104.19.0.0/24",
-"104.20.0.0/24",
-"104.21.0.0/24",
-"104.24.0.0/24",
-"104.25.0.0/24",
-"104.26.0.0/24",
-"104.27.0.0/24",
-"162.159.0.0/24",
-"188.114.96.0/24",
-"103.21.244.0/24",
-"108.162.192.0/24",
-"173.245.48.0/24",
-"103.22.200.0/24",
-"103.31.4.0/24",
-"141.101.64.0/24",
-"108.162.192.0/24",
-"190.93.240.0/24",
-"188.114.96.0/24",
-"197.234.240.0/24",
-"198.41.128.0/24",
-"162.158.0.0/24",
-"104.16.0.0/24",
-"172.64.0.0/24",
-"172.64.128.0/24",
-"172.64.192.0/24",
-"172.64.224.0/24",
-"172.64.229.0/24",
-"172.64.230.0/24",
-"172.64.232.0/24",
-"172.64.240.0/24",
-"172.64.248.0/24",
-"172.65.0.0/24",
-"172.66.0.0/24",
-"172.67.0.0/24",
-"131.0.72.0/24"
-        ]
-        
-        # 从IP段生成部分IP示例
-        for ip_range in ip_ranges:
-            base_ip, cidr = ip_range.split('/')
-            octets = base_ip.split('.')
-            
-            # 生成该网段的一些示例IP
-            for i in range(1, 10):  # 每个网段生成9个示例IP
-                ip = f"{octets[0]}.{octets[1]}.{octets[2]}.{i + int(octets[3])}"
-                self.nodes.add(ip)
-        
-    
-    def test_node_speed(self, ip):
-        """测试单个节点的连接速度"""
-        try:
-            start_time = time.time()
-            # 创建socket连接
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(TEST_TIMEOUT)
-                result = s.connect_ex((ip, TEST_PORT))
-                if result == 0:  # 连接成功
-                    response_time = (time.time() - start_time) * 1000  # 转换为毫秒
-                    return {
-                        'ip': ip,
-                        'reachable': True,
-                        'response_time_ms': int(response_time),
-                        'timestamp': datetime.now().isoformat()
-                    }
-                else:
-                    return {
-                        'ip': ip,
-                        'reachable': False,
-                        'response_time_ms': None,
-                        'timestamp': datetime.now().isoformat()
-                    }
-        except Exception as e:
-            return {
-                'ip': ip,
-                'reachable': False,
-                'response_time_ms': None,
-                'error': str(e),
-                'timestamp': datetime.now().isoformat()
-            }
-    
-    def worker(self, queue):
-        """线程工作函数"""
-        while not queue.empty():
-            ip = queue.get()
-            try:
-                result = self.test_node_speed(ip)
-                with self.lock:
-                    self.results.append(result)
-                    # 每完成360个测试，打印进度
-                    if len(self.results) % 360 == 0:
-                        print(f"已测试 {len(self.results)}/{len(self.nodes)} 个")
-            finally:
-                queue.task_done()
-    
-    def test_all_nodes(self):
-        """测试所有节点的速度"""
-
-        
-        # 创建任务队列
-        queue = Queue()
-        for ip in self.nodes:
-            queue.put(ip)
-        
-        # 启动线程
-        threads = []
-        for _ in range(min(MAX_THREADS, len(self.nodes))):
-            thread = threading.Thread(target=self.worker, args=(queue,))
-            thread.start()
-            threads.append(thread)
-        
-        # 等待所有线程完成
-        for thread in threads:
-            thread.join()
-        
-
-    
-    def sort_and_display_results(self):
-        """排序并显示测试结果，包含中文国家信息"""
-        # 过滤出可连接的节点并按响应时间排序
-        reachable_nodes = [
-            node for node in self.results 
-            if node['reachable'] and node['response_time_ms'] is not None
-        ]
-        
-        # 按响应时间升序排序(最快的在前)
-        sorted_nodes = sorted(
-            reachable_nodes, 
-            key=lambda x: x['response_time_ms']
-        )
-        
-        
-        # 显示前N个最快节点，包含中文国家信息
-        for i, node in enumerate(sorted_nodes[:TOP_NODES], 1):
-            country = get_ip_country(node['ip'])
-            print(f"{node['ip']}#CF 优选IP")
-        
-        return sorted_nodes
-    
-    def save_results(self, results):
-        """只保存前30名结果到TXT文件，并显示中文国家信息"""
-        try:
-            # 只取前30名结果
-            top_results = results[:300]  # 明确只取前30名
-            
-            with open(TXT_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-                # 清空文件并只写入前30个结果
-                for i, node in enumerate(top_results):
-                    # 获取IP的国家信息（已经是中文）
-                    country = get_ip_country(node['ip'])
-                    line = f"{node['ip']}#CF 优选IP {node['response_time_ms']}ms\n"
-                    f.write(line)
-            
-        except Exception as e:
-            print(f"保存结果失败: {e}")
-
-# IP地理位置查询功能
-def batch_query_ip_countries():
-    """批量查询IP地址的国家信息(显示中文)"""
-    print("\n===== IP地址国家信息批量查询 =====")
-    
-    # 从cf_IP.txt文件读取IP地址列表
-    try:
-        with open(TXT_OUTPUT_FILE, 'r', encoding='utf-8') as f:
-            ip_list = []
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and not line.startswith('=') and ':' in line:
-                    # 从格式 "IP:端口#备注" 中提取IP
-                    ip = line.split(':')[0].strip()
-                    ip_list.append(ip)
-                elif line and not line.startswith('#') and not line.startswith('=') and ' ' not in line and '.' in line:
-                    # 纯IP地址行
-                    ip_list.append(line)
-        print(f"从文件读取了 {len(ip_list)} 个IP地址")
-    except Exception as e:
-        print(f"无法从文件读取IP: {str(e)}")
-        print("使用默认IP列表进行演示")
-        # 默认IP列表
-        ip_list = [
-            "108.162.192.3", "108.162.192.7", "108.162.192.4", "108.162.192.9",
-            "162.159.0.4", "162.159.0.1", "162.159.0.3", "108.162.192.2"
-        ]
-    
-    # 清理并验证IP地址列表
-    cleaned_ips = []
-    for ip in ip_list:
-        cleaned_ip = clean_ip(ip)
-        if cleaned_ip:
-            cleaned_ips.append(cleaned_ip)
-        else:
-            print(f"无效的IP地址: {ip}")
-    
-    print(f"清理后有效IP地址数量: {len(cleaned_ips)}")
-    
-    # 获取每个IP的国家信息（已经是中文）
-    results = []
-    for i, ip in enumerate(cleaned_ips):
-        print(f"正在查询 {i+1}/{len(cleaned_ips)}: {ip}")
-        country = get_ip_country(ip)
-        results.append(f"{ip} {country}")
-        
-        # 添加足够的延迟以避免API请求过于频繁
-        if i < len(cleaned_ips) - 1:
-            time.sleep(3)  # 增加延迟到3秒
-    
-    # 将结果写入文件
-    with open(IP_COUNTRIES_FILE, 'w', encoding='utf-8') as f:
-        for result in results:
-            f.write(result + '\n')
-    
-    print(f"\n查询完成！结果已保存到 {IP_COUNTRIES_FILE}")
-    print(f"处理的IP地址总数: {len(results)}")
-    
-    # 显示有国家信息的IP数量
-    successful_queries = sum(1 for r in results if not r.endswith(' 未知'))
-    print(f"获取到国家信息的IP数量: {successful_queries}")
-    print("===================================")
-
-# Cloudflare节点测试功能
-def test_cloudflare_nodes():
-    """运行Cloudflare节点测试"""
-    print("\n===== Cloudflare节点测速工具 =====")
-    tester = CloudflareNodeTester()
-    tester.run()
-
-# CloudflareNodeTester类的run方法
-def run_cloudflare_tester(self):
-    """运行整个测试流程"""
-    start_time = time.time()
-    
-    # 1. 获取节点
-    self.fetch_known_nodes()
-    
-    # 2. 测试所有节点
-    self.test_all_nodes()
-    
-    # 3. 排序并显示结果
-    sorted_nodes = self.sort_and_display_results()
-    
-    # 4. 保存结果
-    self.save_results(sorted_nodes)
-    
-    total_time = int(time.time() - start_time)
-
-# 添加run方法到CloudflareNodeTester类
-CloudflareNodeTester.run = run_cloudflare_tester
-
-# 主函数 - 直接执行Cloudflare节点测试
-if __name__ == "__main__":
-
-    try:
-        # 直接执行Cloudflare节点测试
-        tester = CloudflareNodeTester()
-        tester.run()
-        
-    except KeyboardInterrupt:
-        print("\n用户中断了程序")
-    except Exception as e:
-        print(f"程序出错: {e}")
-
-
-
-
-
-
-
-
-
-
-
-
+import os
+import json
+import argparse
+import socket
+import ssl
+import re
+import bisect
+import sys
+import math
+import random
+import ipaddress
+import heapq
+import itertools
+import statistics
+import time
+import errno
+import struct
+import asyncio
+import selectors
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cfprefix import PrefixIndex
+
+# Cloudflare节点测试配置参数
+TEST_TIMEOUT = 3  # 测试超时时间(秒)
+TEST_PORT = 443   # 测试端口
+TEST_PORTS = None # 多端口探测的端口集合，如 [443, 2053, 2083, 2087, 2096, 8443]；为None时只测TEST_PORT
+OUTPUT_DEFAULT_PORT = 443 # 输出中省略端口时使用方(index.html生成VLESS链接)默认的端口
+HOST_INFLIGHT = 1 # 多端口时同一IP同时进行的最大探测数，避免同一时刻打满一个IP的所有端口
+MAX_THREADS = 30  # 最大线程数
+PROBE_ENGINE = "asyncio"  # 探测引擎: thread(线程) / asyncio(协程) / selectors(单线程epoll批量)
+MAX_CONCURRENCY = 1000    # asyncio/selectors引擎同时进行的最大连接数
+CONNECT_BATCH = 256       # selectors引擎每轮最多新发起的连接数
+PROBE_RATE = 0            # 全局限速(每秒发起的探测数)，0表示不限速
+PREFIX_INFLIGHT = 16      # 同一个/24同时进行的最大探测数，0表示不限制
+PREFIX_FILE = None  # 网段列表文件(如 "ip/Cloudflare-IP.txt")，为None时使用内置ip_ranges
+HOSTS_PER_24 = 9    # 每个/24网段分层随机抽取的主机数
+IPV6_PREFIXES = []  # 额外扫描的IPv6网段(如 "2606:4700::/32")，需要本机有IPv6连接；为空时只扫描IPv4
+IPV6_HOSTS_PER_PREFIX = 50  # 每个IPv6网段随机抽取的地址数(IPv6网段无法逐个枚举，随机生成接口标识)
+SAMPLE_SEED = None  # 抽样随机种子，为None时取当前UTC小时(同一小时内可复现)
+SHARD_PROCESSES = 1       # 分片进程数，每个进程有独立的事件循环；0表示使用全部CPU核心
+SHARD_MIN_NODES = 2000    # 节点数少于此值时不分片
+# 分片进程需要沿用的运行时设置(命令行和use_profiles会改写)；spawn方式启动的子进程会重新导入本模块，只能拿到默认值
+SHARD_SETTINGS = ('REGIONS', 'MAIN_OUTPUT', 'TEST_PORT', 'TEST_PORTS', 'HOST_INFLIGHT', 'TEST_TIMEOUT',
+                  'MAX_THREADS', 'MAX_CONCURRENCY', 'PROBE_ENGINE', 'CONNECT_BATCH', 'PREFIX_INFLIGHT',
+                  'SAMPLES_PER_IP', 'SAMPLE_INTERVAL', 'RANK_STAT', 'RESULT_POOL', 'TOP_NODES',
+                  'TLS_CANDIDATES', 'PREFIX_FILE', 'IPV6_PREFIXES', 'SAMPLE_SEED')
+SAMPLES_PER_IP = 1        # 每个IP的连接采样次数，多次采样分多轮进行
+SAMPLE_INTERVAL = 1.0     # 相邻两轮采样开始时间的最小间隔(秒)
+RANK_STAT = "median"      # 多次采样时用于排序的统计量: min / median / p95
+MAX_LOSS = 0.5            # 丢包率超过此值的节点不参与排名
+SCAN_MODE = "flat"        # 扫描模式: flat(所有候选同等测试) / adaptive(粗筛后逐轮淘汰慢网段)
+PROBE_BUDGET = 3000       # adaptive模式的总探测次数(每个IP按端口数×每IP采样次数计)
+SCREEN_HOSTS_PER_24 = 2   # adaptive模式第一阶段每个/24探测的主机数
+TLS_PROBE = False         # 是否对TCP最快的候选节点再做一次真实的TLS握手测试
+TLS_SNI = "cf.cloudip.ggff.net"  # TLS握手使用的SNI/Host，与节点生成器(index.html)的默认域名一致
+TLS_CANDIDATES = 500      # 参与TLS握手测试的候选数(按TCP延迟取前N个)
+TLS_CONCURRENCY = 100     # TLS握手测试的最大并发数
+TRACE_PROBE = False       # 是否在TLS连接上请求/cdn-cgi/trace，记录实际服务的数据中心(colo)和地区(loc)
+COLO_FILTER = []          # 只保留这些数据中心的节点(如 ["SJC", "LAX"])，为空时不过滤
+TCP_INFO_PROBE = False    # 是否在TLS连接上读取内核TCP_INFO(tcpi_rtt/tcpi_rttvar/重传次数)，仅Linux支持
+HTTP_PINGS = 0            # 在同一keep-alive的TLS连接上发送的HEAD请求次数，0表示不发送
+HISTORY_FILE = "ip/All-history.json"  # 跨运行的历史评分文件(相对仓库根目录)，为None时不使用
+HISTORY_ALPHA = 0.3       # 本次结果在指数加权移动平均中的权重，越大历史衰减越快
+HISTORY_FAIL_PENALTY = 1000   # 综合评分中成功率每降低100%增加的毫秒数
+HISTORY_MAX_AGE = 7 * 86400   # 超过此秒数未再测到的IP从历史中移除
+HISTORY_MAX_ENTRIES = 3000    # 历史最多保存的IP数(按综合评分保留最好的)
+WARM_START = True         # 有历史时只复测历史最好的IP，再探索一部分新候选(flat模式)
+WARM_START_TOP = 300      # 热启动时复测的历史IP数
+EXPLORE_FRACTION = 0.2    # 热启动时从本次抽样的新候选中探索的比例
+RANK_METRIC = "connect"   # 排名依据: connect(TCP连接，启用TLS测试时加上握手) / kernel_rtt(内核RTT) / http_ping(HEAD往返)
+SPEED_TEST = False        # 是否对延迟排名靠前的节点做下载测速
+SPEED_TEST_TOP = 10       # 参与下载测速的节点数(按延迟排名取前N个)
+SPEED_TEST_HOST = "speed.cloudflare.com"      # 测速下载使用的SNI/Host
+SPEED_TEST_PATH = "/__down?bytes=50000000"    # 测速下载路径
+SPEED_TEST_MAX_BYTES = 50 * 1024 * 1024       # 单个节点最多下载的字节数
+SPEED_TEST_MAX_SECONDS = 10                   # 单个节点最长下载时间(秒)
+SPEED_TEST_WARMUP = 2     # 起步阶段时长(秒)，结束时速度低于SPEED_TEST_MIN_SPEED则提前放弃
+SPEED_TEST_MIN_SPEED = 0.5                    # 起步阶段的最低速度(MB/s)
+SPEED_BUFFER_SIZE = 256 * 1024                # 复用的接收缓冲区大小
+TOP_NODES = 100    # 显示和保存前N个最快节点
+RESULT_POOL = 1000        # 流式排名保留的最快可达结果数(各分片也各自保留这么多)
+TXT_OUTPUT_FILE = "IP.txt"    # TXT结果保存文件
+
+GEO_FILE = "ip/geo.csv"   # 离线网段位置对照表(相对仓库根目录)
+GEO_REMOTE_LOOKUP = True  # 离线表中查不到时是否调用在线接口
+GEO_CACHE_FILE = "ip/geo-cache.jsonl"  # 在线查询结果缓存(相对仓库根目录)，为None时不缓存
+GEO_CACHE_TTL = 30 * 86400    # 查询成功的结果缓存秒数
+GEO_NEGATIVE_TTL = 86400      # 查询失败的结果缓存秒数，避免反复请求查不到的IP
+# 在线位置接口，按顺序回退: kind为接口协议，batch为每次请求最多查询的IP数，per_minute为每分钟最多请求数
+GEO_PROVIDERS = [
+    {"name": "ip-api", "kind": "ip-api", "url": "http://ip-api.com/batch?fields=status,countryCode,query",
+     "batch": 100, "per_minute": 15},
+    {"name": "ipwhois", "kind": "ipwhois", "url": "https://ipwhois.app/json/{ip}",
+     "batch": 1, "per_minute": 60},
+]
+GEO_WORKERS = 4           # 同时进行的在线查询请求数
+GEO_MAX_WAIT = 10         # 接口配额用完时最多等待的秒数，超过则交给下一个接口(最后一个接口总是等待)
+IP_COUNTRIES_FILE = "ip_countries.txt"  # 批量查询国家信息的结果文件
+
+PROFILE_DIR = "profiles"  # 地区配置目录(相对仓库根目录)，每个地区一个JSON文件，文件名即地区名
+MAIN_OUTPUT = True        # 是否扫描内置网段并输出总榜；命令行只选择地区配置时为False
+
+# 仓库根目录，相对路径的网段文件以此为基准
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 国家代码到中文国家名称的映射
+COUNTRY_CODES = {
+    'US': '美国',
+    'CN': '中国',
+    'JP': '日本',
+    'SG': '新加坡',
+    'KR': '韩国',
+    'GB': '英国',
+    'FR': '法国',
+    'DE': '德国',
+    'AU': '澳大利亚',
+    'CA': '加拿大',
+    'HK': '中国香港',
+    'TW': '中国台湾',
+    'IN': '印度',
+    'RU': '俄罗斯',
+    'BR': '巴西',
+    'MX': '墨西哥',
+    'NL': '荷兰',
+    'SE': '瑞典',
+    'CH': '瑞士',
+    'IT': '意大利',
+    'ES': '西班牙',
+    'Unknown': '未知'
+}
+
+class GeoIndex:
+    """离线的网段 -> (国家代码, 数据中心) 索引
+
+    网段在加载时展开为互不重叠的有序区间，查询用二分查找，复杂度O(log n)。
+    """
+    
+    def __init__(self, rows):
+        """rows为(起始整数, 结束整数, 国家代码, 数据中心)，重叠时范围更小(或起点更靠后)的优先"""
+        self.starts = array('I')
+        self.ends = array('I')
+        self.values = []
+        stack = []   # 当前包含扫描位置的区间，栈顶最具体
+        pos = 0
+        for start, end, *value in sorted(rows, key=lambda r: (r[0], -r[1])):
+            while stack and stack[-1][0] < start:
+                top_end, top_value = stack.pop()
+                if pos <= top_end:
+                    self.add_segment(pos, top_end, top_value)
+                    pos = top_end + 1
+            if stack and pos < start:
+                self.add_segment(pos, start - 1, stack[-1][1])
+            stack.append((end, tuple(value)))
+            pos = start
+        while stack:
+            top_end, top_value = stack.pop()
+            if pos <= top_end:
+                self.add_segment(pos, top_end, top_value)
+                pos = top_end + 1
+    
+    def add_segment(self, start, end, value):
+        """追加一个区间，与前一个区间相邻且值相同时合并"""
+        if self.values and self.values[-1] == value and self.ends[-1] + 1 == start:
+            self.ends[-1] = end
+            return
+        self.starts.append(start)
+        self.ends.append(end)
+        self.values.append(value)
+    
+    @classmethod
+    def load(cls, path):
+        """从CSV文件加载: 每行 网段(CIDR或 起始IP-结束IP),国家代码[,数据中心]，#开头为注释"""
+        rows = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                fields = [field.strip() for field in line.split(',')]
+                try:
+                    if '-' in fields[0]:
+                        first, last = fields[0].split('-', 1)
+                        start = int(ipaddress.IPv4Address(first.strip()))
+                        end = int(ipaddress.IPv4Address(last.strip()))
+                    else:
+                        network = ipaddress.IPv4Network(fields[0], strict=False)
+                        start = int(network.network_address)
+                        end = int(network.broadcast_address)
+                except ValueError:
+                    print(f"无效的网段: {fields[0]}", file=sys.stderr)
+                    continue
+                country = fields[1] if len(fields) > 1 and fields[1] else None
+                colo = fields[2] if len(fields) > 2 and fields[2] else None
+                rows.append((start, end, country, colo))
+        return cls(rows)
+    
+    def lookup(self, ip):
+        """返回(国家代码, 数据中心)，查不到时返回None"""
+        value = int.from_bytes(socket.inet_aton(ip), 'big')
+        i = bisect.bisect_right(self.starts, value) - 1
+        if i >= 0 and value <= self.ends[i]:
+            return self.values[i]
+        return None
+    
+    def __len__(self):
+        return len(self.values)
+
+GEO_INDEX = None  # 首次查询时从GEO_FILE加载
+
+def geo_index():
+    """返回离线位置索引，首次调用时加载，文件不存在时为空索引"""
+    global GEO_INDEX
+    if GEO_INDEX is None:
+        path = GEO_FILE if os.path.isabs(GEO_FILE) else os.path.join(REPO_DIR, GEO_FILE)
+        try:
+            GEO_INDEX = GeoIndex.load(path)
+        except OSError as e:
+            print(f"读取离线位置表失败: {e}", file=sys.stderr)
+            GEO_INDEX = GeoIndex([])
+    return GEO_INDEX
+
+def lookup_location(ip):
+    """离线查询IP的(国家代码, 数据中心)，查不到时返回None"""
+    try:
+        return geo_index().lookup(ip)
+    except OSError:  # 非法IPv4地址
+        return None
+
+class GeoCache:
+    """在线位置查询结果的磁盘缓存(JSON lines)，按/24缓存，查询失败的结果也缓存但有效期较短
+
+    每次写入追加一行，加载时后写的行覆盖先写的；过期或重复的行较多时重写文件。
+    """
+    
+    def __init__(self, path):
+        self.path = path if os.path.isabs(path) else os.path.join(REPO_DIR, path)
+        self.entries = {}  # /24 -> (中文国家名或None, 写入时间)，None表示查询失败
+        self.lock = threading.Lock()
+        lines = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.entries[record['key']] = (record.get('country'), record['time'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    lines += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"读取位置缓存失败: {e}", file=sys.stderr)
+        now = int(time.time())
+        self.entries = {key: entry for key, entry in self.entries.items() if self.fresh(entry, now)}
+        if lines > 2 * len(self.entries) + 100:
+            self.rewrite()
+    
+    def fresh(self, entry, now):
+        """缓存项是否仍在有效期内"""
+        ttl = GEO_CACHE_TTL if entry[0] is not None else GEO_NEGATIVE_TTL
+        return now - entry[1] < ttl
+    
+    def get(self, key, now):
+        """返回有效的缓存项(国家, 写入时间)，没有或已过期时返回None"""
+        entry = self.entries.get(key)
+        if entry is not None and self.fresh(entry, now):
+            return entry
+        return None
+    
+    def put(self, key, country, now):
+        """记录一次查询结果(失败时country为None)并追加到文件"""
+        with self.lock:
+            self.entries[key] = (country, now)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'key': key, 'country': country, 'time': now}, ensure_ascii=False) + '\n')
+            except OSError as e:
+                print(f"写入位置缓存失败: {e}", file=sys.stderr)
+    
+    def rewrite(self):
+        """只保留有效的缓存项，原子地重写文件"""
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for key, (country, written) in self.entries.items():
+                    f.write(json.dumps({'key': key, 'country': country, 'time': written}, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"重写位置缓存失败: {e}", file=sys.stderr)
+
+GEO_CACHE = None    # 首次在线查询时加载
+GEO_SESSION = None  # 所有在线查询共用的HTTP会话
+
+def geo_cache():
+    """返回在线查询结果缓存，GEO_CACHE_FILE为None时返回None"""
+    global GEO_CACHE
+    if GEO_CACHE is None and GEO_CACHE_FILE:
+        GEO_CACHE = GeoCache(GEO_CACHE_FILE)
+    return GEO_CACHE
+
+def geo_session():
+    """返回共用的HTTP会话(带重试)，首次调用时创建"""
+    global GEO_SESSION
+    if GEO_SESSION is None:
+        import requests
+        session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        GEO_SESSION = session
+    return GEO_SESSION
+
+# 英文国家名到中文的映射(ipwhois.app返回英文国家名)
+COUNTRY_NAMES = {
+    'United States': '美国',
+    'China': '中国',
+    'Japan': '日本',
+    'Singapore': '新加坡',
+    'South Korea': '韩国',
+    'United Kingdom': '英国',
+    'France': '法国',
+    'Germany': '德国',
+    'Australia': '澳大利亚',
+    'Canada': '加拿大',
+    'Hong Kong': '中国香港',
+    'Taiwan': '中国台湾',
+}
+
+def fetch_ipwhois(session, url, ips):
+    """用ipwhois.app逐个查询(不需要API密钥)，返回 IP -> 中文国家名(查不到的不包含)"""
+    countries = {}
+    for ip in ips:
+        response = session.get(url.format(ip=ip), timeout=15)
+        response.raise_for_status()
+        country = response.json().get('country')
+        if country:
+            # 如果是国家代码，尝试从映射中获取中文名称
+            countries[ip] = COUNTRY_CODES.get(country, country) if len(country) == 2 else COUNTRY_NAMES.get(country, country)
+    return countries
+
+def fetch_ip_api(session, url, ips):
+    """用ip-api.com的批量接口一次查询多个IP(使用HTTP而非HTTPS)，返回 IP -> 中文国家名"""
+    response = session.post(url, json=list(ips), timeout=15)
+    response.raise_for_status()
+    countries = {}
+    for data in response.json():
+        if data.get('status') == 'success' and data.get('countryCode'):
+            countries[data['query']] = COUNTRY_CODES.get(data['countryCode'], data['countryCode'])
+    return countries
+
+# 接口协议 -> 查询函数，查询函数遇到网络或HTTP错误时抛出异常
+GEO_FETCHERS = {
+    'ip-api': fetch_ip_api,
+    'ipwhois': fetch_ipwhois,
+}
+
+class RateQuota:
+    """线程安全的令牌桶: 平均每分钟最多per_minute次请求，令牌用完时按需等待而不是固定sleep"""
+    
+    def __init__(self, per_minute, burst=1):
+        self.rate = per_minute / 60
+        self.capacity = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self, max_wait=None):
+        """取一个令牌，需要等待超过max_wait秒时放弃并返回False"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                return False
+            time.sleep(wait)
+
+class GeoLookupClient:
+    """并发的批量位置查询: 先查离线表和缓存，每个/24只在线查询一个IP，
+    按接口的批量大小分批并发请求，每个接口有独立配额，某批失败或查不到的IP交给下一个接口"""
+    
+    def __init__(self, providers=None, workers=GEO_WORKERS):
+        self.providers = GEO_PROVIDERS if providers is None else providers
+        self.workers = workers
+        self.quotas = {p['name']: RateQuota(p['per_minute']) for p in self.providers}
+    
+    def resolve(self, ips):
+        """在线查询一组IP，按顺序尝试各接口，返回 IP -> 中文国家名(都查不到的不包含)"""
+        answers = {}
+        remaining = list(ips)
+        for i, provider in enumerate(self.providers):
+            if not remaining:
+                break
+            last = i == len(self.providers) - 1
+            quota = self.quotas[provider['name']]
+            fetch = GEO_FETCHERS[provider['kind']]
+            missed = []
+            for start in range(0, len(remaining), provider['batch']):
+                chunk = remaining[start:start + provider['batch']]
+                if not quota.acquire(None if last else GEO_MAX_WAIT):
+                    missed.extend(chunk)  # 配额暂时用完，交给下一个接口
+                    continue
+                try:
+                    found = fetch(geo_session(), provider['url'], chunk)
+                except (OSError, ValueError) as e:
+                    print(f"{provider['name']}查询失败: {e}", file=sys.stderr)
+                    found = {}
+                answers.update(found)
+                missed.extend(ip for ip in chunk if ip not in found)
+            remaining = missed
+        return answers
+    
+    def lookup(self, ips):
+        """查询一组IP的中文国家名，返回 IP -> 国家(查不到为'未知')，在线结果(包括失败)写入缓存"""
+        results = {}
+        pending = {}   # /24 -> 代表IP
+        cache = geo_cache()
+        now = int(time.time())
+        for ip in ips:
+            location = lookup_location(ip)
+            if location is not None and location[0]:
+                results[ip] = COUNTRY_CODES.get(location[0], location[0])
+                continue
+            key = prefix_key(ip)
+            entry = cache.get(key, now) if cache is not None else None
+            if entry is not None:
+                results[ip] = entry[0] or '未知'
+            else:
+                pending.setdefault(key, ip)
+        
+        found = {}
+        if pending and GEO_REMOTE_LOOKUP:
+            queries = list(pending.values())
+            size = max(p['batch'] for p in self.providers)
+            jobs = [queries[i:i + size] for i in range(0, len(queries), size)]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for answers in executor.map(self.resolve, jobs):
+                    found.update(answers)
+            if cache is not None:
+                for key, ip in pending.items():
+                    cache.put(key, found.get(ip), now)
+        
+        for ip in ips:
+            if ip not in results:
+                results[ip] = found.get(pending.get(prefix_key(ip))) or '未知'
+        return results
+
+GEO_CLIENT = None  # 单个IP查询共用的客户端，使配额在多次调用间生效
+
+def geo_client():
+    """返回共用的位置查询客户端，首次调用时创建"""
+    global GEO_CLIENT
+    if GEO_CLIENT is None:
+        GEO_CLIENT = GeoLookupClient()
+    return GEO_CLIENT
+
+def query_remote_country(ip):
+    """依次调用各在线接口，返回第一个查到的中文国家名，都失败时返回None"""
+    return geo_client().resolve([ip]).get(ip)
+
+# IP地理位置查询函数
+def get_ip_country(ip):
+    """获取IP地址对应的国家信息(返回中文)
+
+    先查离线位置表，再查在线结果缓存(按/24)，都没有时才调用在线接口并缓存结果(包括失败)。
+    """
+    try:
+        # 验证IP格式
+        ipaddress.ip_address(ip)
+        
+        # 离线位置表(只有IPv4)
+        location = lookup_location(ip)
+        if location is not None and location[0]:
+            return COUNTRY_CODES.get(location[0], location[0])
+        if not GEO_REMOTE_LOOKUP:
+            return '未知'
+        
+        # 在线查询结果缓存
+        cache = geo_cache()
+        key = prefix_key(ip)
+        now = int(time.time())
+        if cache is not None:
+            entry = cache.get(key, now)
+            if entry is not None:
+                return entry[0] or '未知'
+        
+        country = query_remote_country(ip)
+        if cache is not None:
+            cache.put(key, country, now)
+        return country or '未知'
+    except Exception as e:
+        print(f"IP验证错误 {ip}: {str(e)}")
+        return '未知'
+
+def clean_ip(ip_str):
+    """清理IP字符串，移除可能的冒号、方括号或其他字符，支持IPv4和IPv6"""
+    ip_str = ip_str.strip()
+    if ip_str.startswith('['):
+        # [IPv6] 或 [IPv6]:端口
+        ip_str = ip_str[1:].split(']', 1)[0]
+        try:
+            return str(ipaddress.IPv6Address(ip_str))
+        except ValueError:
+            return None
+    # 移除末尾的冒号和空格
+    ip_str = ip_str.rstrip(':')
+    if ip_str.count(':') >= 2:
+        try:
+            return str(ipaddress.IPv6Address(ip_str))
+        except ValueError:
+            return None
+    # 验证是否为有效的IPv4地址
+    pattern = r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$'
+    if re.match(pattern, ip_str):
+        # 进一步验证每个数字是否在0-255范围内
+        parts = ip_str.split('.')
+        if all(0 <= int(part) <= 255 for part in parts):
+            return ip_str
+    return None
+
+# 非阻塞connect已发出、正在握手时返回的错误码
+CONNECT_PENDING = {0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, 10035}  # 10035为Windows的WSAEWOULDBLOCK
+
+def raise_nofile_limit(wanted):
+    """尽量提高进程可打开的文件描述符上限，返回实际可用的并发连接数"""
+    try:
+        import resource
+    except ImportError:  # Windows没有resource模块
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = wanted + 64  # 为标准输入输出、日志等预留描述符
+    if soft != resource.RLIM_INFINITY and soft < target:
+        new_soft = target if hard == resource.RLIM_INFINITY else min(target, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+            soft = new_soft
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return wanted
+    return max(1, min(wanted, soft - 64))
+
+def load_prefix_file(path):
+    """读取网段列表文件(每行一个CIDR，忽略空行和#注释)，返回合并去重后的CIDR列表
+
+    合并结果缓存在网段文件旁的.idx二进制文件中，文件未变化时直接加载。
+    """
+    if not os.path.isabs(path) and not os.path.exists(path):
+        path = os.path.join(REPO_DIR, path)
+    return [str(network) for network in PrefixIndex.load(path).networks()]
+
+def sample_seed():
+    """抽样种子: 优先使用SAMPLE_SEED，否则取当前UTC小时，每小时换一批主机，同一小时内重跑结果一致"""
+    if SAMPLE_SEED is not None:
+        return SAMPLE_SEED
+    return datetime.now(timezone.utc).strftime('%Y%m%d%H')
+
+def iter_subnets_24(prefixes):
+    """把网段列表展开为去重后的/24子网(比/24更小的网段保持原样)"""
+    seen = set()
+    for prefix in prefixes:
+        try:
+            network = ipaddress.ip_network(prefix.strip(), strict=False)
+        except ValueError:
+            print(f"无效的网段: {prefix}", file=sys.stderr)
+            continue
+        if network.version != 4:
+            continue
+        subnets = [network] if network.prefixlen >= 24 else network.subnets(new_prefix=24)
+        for subnet in subnets:
+            if subnet not in seen:
+                seen.add(subnet)
+                yield subnet
+
+def iter_ipv6_networks(prefixes):
+    """网段列表中去重后的IPv6网段"""
+    seen = set()
+    for prefix in prefixes:
+        if ':' not in prefix:
+            continue
+        try:
+            network = ipaddress.IPv6Network(prefix.strip(), strict=False)
+        except ValueError:
+            print(f"无效的网段: {prefix}", file=sys.stderr)
+            continue
+        if network not in seen:
+            seen.add(network)
+            yield network
+
+def host_range(subnet):
+    """返回子网内可用主机偏移的区间[low, high)，排除网络地址和广播地址"""
+    size = subnet.num_addresses
+    return (1, size - 1) if size > 2 else (0, size)
+
+def sample_subnet_hosts(subnet, count, seed):
+    """在单个子网内分层抽样: 主机区间均分为count段，每段随机取一个地址"""
+    base = int(subnet.network_address)
+    low, high = host_range(subnet)
+    count = min(count, high - low)
+    if count <= 0:
+        return []
+    rng = random.Random(f"{seed}/{subnet}")
+    span = (high - low) / count
+    hosts = []
+    for k in range(count):
+        start = low + int(k * span)
+        end = max(start + 1, low + int((k + 1) * span))
+        hosts.append(str(ipaddress.IPv4Address(base + rng.randrange(start, end))))
+    return hosts
+
+def sample_ipv6_hosts(network, count, seed):
+    """在IPv6网段内随机抽取count个地址: 网段之后的位(包括接口标识)全部随机生成"""
+    host_bits = network.max_prefixlen - network.prefixlen
+    if host_bits == 0:
+        return [str(network.network_address)]
+    rng = random.Random(f"{seed}/{network}")
+    base = int(network.network_address)
+    # 跳过偏移0(子网路由器任播地址)
+    hosts = (str(ipaddress.IPv6Address(base + rng.randrange(1, 1 << host_bits))) for _ in range(count))
+    return list(dict.fromkeys(hosts))
+
+def sample_prefix_hosts(prefixes, hosts_per_24, seed):
+    """按/24分层抽样，每个/24抽取hosts_per_24个地址；IPv6网段各随机抽取IPV6_HOSTS_PER_PREFIX个地址
+
+    每个网段使用由(种子, 网段)派生的独立随机数发生器，增删其他网段不影响其抽样结果。
+    """
+    prefixes = list(prefixes)
+    for subnet in iter_subnets_24(prefixes):
+        yield from sample_subnet_hosts(subnet, hosts_per_24, seed)
+    for network in iter_ipv6_networks(prefixes):
+        yield from sample_ipv6_hosts(network, IPV6_HOSTS_PER_PREFIX, seed)
+
+def ip_family(ip):
+    """IP对应的socket地址族"""
+    return socket.AF_INET6 if ':' in ip else socket.AF_INET
+
+def format_ip(ip):
+    """输出用的地址: IPv6加方括号，便于拼接端口或#备注"""
+    return f"[{ip}]" if ':' in ip else ip
+
+def probe_ports():
+    """本次探测的端口列表"""
+    return list(TEST_PORTS) if TEST_PORTS else [TEST_PORT]
+
+class BlankField:
+    """地区模板中缺失字段的占位，任意格式说明都输出空字符串"""
+    
+    def __format__(self, spec):
+        return ''
+
+class TemplateFields(dict):
+    """地区模板的字段: 节点缺少或为None的可选字段(如colo、download_speed、ping_ms)输出为空"""
+    
+    def __missing__(self, key):
+        return BlankField()
+
+def format_region_line(template, node, name):
+    """按地区模板格式化一个节点，模板本身有误时退回默认格式 地址#地区名"""
+    fields = TemplateFields((key, value) for key, value in node.items() if value is not None)
+    fields['ip'] = format_endpoint(node)
+    try:
+        return template.format_map(fields)
+    except (ValueError, TypeError, IndexError, AttributeError) as e:
+        print(f"地区{name}的模板无法格式化({e})，使用默认格式", file=sys.stderr)
+        return f"{fields['ip']}#{name}"
+
+def format_endpoint(node):
+    """输出用的节点地址: 多端口探测或端口不是OUTPUT_DEFAULT_PORT时为 地址:端口，否则只有地址"""
+    port = node.get('port', TEST_PORT)
+    if len(probe_ports()) > 1 or port != OUTPUT_DEFAULT_PORT:
+        return f"{format_ip(node['ip'])}:{port}"
+    return format_ip(node['ip'])
+
+def make_tls_context():
+    """创建用于测速的TLS上下文: 只关心握手耗时，不校验证书"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+async def open_tls_session(ip, port, sni, timeout, context=None):
+    """连接到ip:port并以sni完成TLS握手，返回(reader, writer, 连接毫秒, 握手毫秒)
+
+    context为None时不做TLS(用于本地明文测试服务器)，握手毫秒为None。
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(ip_family(ip), socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        start_time = time.perf_counter()
+        await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+        connected = time.perf_counter()
+        if context is None:
+            reader, writer = await asyncio.open_connection(sock=sock)
+            return reader, writer, (connected - start_time) * 1000, None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(sock=sock, ssl=context, server_hostname=sni),
+            timeout
+        )
+        handshaked = time.perf_counter()
+        return reader, writer, (connected - start_time) * 1000, (handshaked - connected) * 1000
+    except BaseException:
+        sock.close()
+        raise
+
+async def read_http_response(reader, timeout, head_request=False):
+    """读取一个HTTP/1.1响应，返回(状态码, 头部字典, 正文)，支持Content-Length和chunked
+
+    head_request为True时表示是HEAD请求的响应，没有正文。
+    """
+    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    
+    if head_request:
+        return status, headers, b''
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = bytearray()
+        while True:
+            size_line = await asyncio.wait_for(reader.readuntil(b'\r\n'), timeout)
+            size = int(size_line.split(b';', 1)[0], 16)
+            chunk = await asyncio.wait_for(reader.readexactly(size + 2), timeout)
+            if size == 0:
+                break
+            body += chunk[:-2]
+        return status, headers, bytes(body)
+    if 'content-length' in headers:
+        body = await asyncio.wait_for(reader.readexactly(int(headers['content-length'])), timeout)
+        return status, headers, body
+    return status, headers, await asyncio.wait_for(reader.read(), timeout)
+
+def parse_trace(text):
+    """解析/cdn-cgi/trace返回的 key=value 文本"""
+    info = {}
+    for line in text.splitlines():
+        if '=' in line:
+            key, value = line.split('=', 1)
+            info[key.strip()] = value.strip()
+    return info
+
+async def fetch_trace(reader, writer, host, timeout):
+    """在已建立的连接上请求/cdn-cgi/trace并解析结果(连接保持keep-alive)"""
+    request = (
+        f"GET /cdn-cgi/trace HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        f"User-Agent: CloudflareIP\r\n"
+        f"Connection: keep-alive\r\n\r\n"
+    )
+    writer.write(request.encode('ascii'))
+    await writer.drain()
+    status, _, body = await read_http_response(reader, timeout)
+    if status != 200:
+        raise ValueError(f"trace返回HTTP {status}")
+    return parse_trace(body.decode('utf-8', errors='replace'))
+
+async def http_ping(reader, writer, host, timeout):
+    """在已建立的连接上发送一次HEAD请求，返回往返毫秒数；服务器要求关闭连接时抛出ConnectionError"""
+    request = (
+        f"HEAD / HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        f"User-Agent: CloudflareIP\r\n"
+        f"Connection: keep-alive\r\n\r\n"
+    )
+    start_time = time.perf_counter()
+    writer.write(request.encode('ascii'))
+    await writer.drain()
+    _, headers, _ = await read_http_response(reader, timeout, head_request=True)
+    elapsed = (time.perf_counter() - start_time) * 1000
+    if headers.get('connection', '').lower() == 'close':
+        raise ConnectionError("服务器关闭了keep-alive连接")
+    return elapsed
+
+def read_tcp_info(sock):
+    """读取Linux内核的TCP_INFO，返回(平滑RTT毫秒, RTT方差毫秒, 累计重传次数)，不支持时返回None
+
+    struct tcp_info开头是8个u8，随后是u32字段: tcpi_rtt、tcpi_rttvar、tcpi_total_retrans
+    分别位于第15、16、23个u32(单位微秒)。
+    """
+    if not hasattr(socket, 'TCP_INFO'):
+        return None
+    try:
+        data = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+    except OSError:
+        return None
+    if len(data) < 104:
+        return None
+    fields = struct.unpack_from('8B24I', data)
+    return fields[8 + 15] / 1000, fields[8 + 16] / 1000, fields[8 + 23]
+
+async def close_session(writer):
+    """关闭连接，忽略关闭过程中的错误"""
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+
+def download_speed(ip, port, host, path, buffer, context):
+    """通过ip:port以host下载path，返回速度(MB/s)
+
+    数据直接recv_into到复用的buffer中不做保存；达到字节或时间上限即停止，
+    起步阶段过慢(包括停滞)的节点提前放弃并抛出ValueError，视为测速失败。
+    """
+    view = memoryview(buffer)
+    request = (
+        f"GET {path} HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        f"User-Agent: CloudflareIP\r\n"
+        f"Connection: close\r\n\r\n"
+    )
+    with socket.create_connection((ip, port), timeout=TEST_TIMEOUT) as raw:
+        with context.wrap_socket(raw, server_hostname=host) as s:
+            s.sendall(request.encode('ascii'))
+            
+            # 读取响应头，缓冲区中头部之后的数据计入正文
+            received = 0
+            while True:
+                n = s.recv_into(view[received:])
+                if n == 0:
+                    raise ConnectionError("响应头未完整返回")
+                received += n
+                header_end = buffer.find(b'\r\n\r\n', 0, received)
+                if header_end >= 0:
+                    break
+                if received == len(buffer):
+                    raise ValueError("响应头过长")
+            status = buffer[:buffer.find(b'\r\n')].split()[1]
+            if status != b'200':
+                raise ValueError(f"测速返回HTTP {status.decode('latin-1')}")
+            
+            body = received - header_end - 4
+            start_time = time.perf_counter()
+            warmed_up = False
+            while body < SPEED_TEST_MAX_BYTES:
+                elapsed = time.perf_counter() - start_time
+                if elapsed >= SPEED_TEST_MAX_SECONDS:
+                    break
+                if not warmed_up and elapsed >= SPEED_TEST_WARMUP:
+                    warmed_up = True
+                    if body / 1048576 / elapsed < SPEED_TEST_MIN_SPEED:
+                        raise ValueError(f"起步阶段速度过慢({body / 1048576 / elapsed:.2f}MB/s)")
+                # 起步阶段内每次等待不超过起步阶段的剩余时间，停滞的节点到时即可判定
+                deadline = SPEED_TEST_MAX_SECONDS if warmed_up else min(SPEED_TEST_WARMUP, SPEED_TEST_MAX_SECONDS)
+                s.settimeout(max(0.01, deadline - elapsed))
+                try:
+                    n = s.recv_into(view, min(len(buffer), SPEED_TEST_MAX_BYTES - body))
+                except socket.timeout:
+                    if warmed_up:
+                        break
+                    continue
+                if n == 0:
+                    break
+                body += n
+            elapsed = time.perf_counter() - start_time
+    return body / 1048576 / elapsed if elapsed > 0 else 0.0
+
+def load_profiles(path):
+    """读取地区配置目录中的所有JSON文件，返回 地区名 -> 配置
+
+    每个配置包含 prefixes(网段)、hosts_per_24(每个/24抽样数)、ports(端口列表，也可写单个port)、top(保存前N个)、
+    timeout(超时秒数)、concurrency(并发数)、template(每行格式，可用结果中的字段)、file(输出文件)，
+    除prefixes外缺省时使用模块常量。ports、timeout、concurrency只在用--profile单独运行时生效，
+    不带参数的总榜扫描所有地区共用TEST_PORT(S)、TEST_TIMEOUT和MAX_CONCURRENCY。
+    """
+    if not os.path.isabs(path) and not os.path.isdir(path):
+        path = os.path.join(REPO_DIR, path)
+    profiles = {}
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return profiles
+    for filename in names:
+        name, ext = os.path.splitext(filename)
+        if ext != '.json':
+            continue
+        try:
+            with open(os.path.join(path, filename), 'r', encoding='utf-8') as f:
+                profile = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取地区配置{filename}失败: {e}", file=sys.stderr)
+            continue
+        prefixes = profile.get('prefixes') if isinstance(profile, dict) else None
+        if not isinstance(prefixes, list) or not prefixes:
+            print(f"地区配置{filename}缺少prefixes网段列表，已跳过", file=sys.stderr)
+            continue
+        profiles[name] = {
+            'prefixes': prefixes,
+            'hosts_per_24': profile.get('hosts_per_24', HOSTS_PER_24),
+            'ports': profile.get('ports', [profile.get('port', TEST_PORT)]),
+            'top': profile.get('top', TOP_NODES),
+            'timeout': profile.get('timeout', TEST_TIMEOUT),
+            'concurrency': profile.get('concurrency', MAX_CONCURRENCY),
+            'template': profile.get('template', '{ip}#' + name),
+            'file': profile.get('file', f"{name}.txt"),
+        }
+    return profiles
+
+REGIONS = load_profiles(PROFILE_DIR)  # 地区名 -> 配置，同一次扫描的结果按地区分别排名输出
+
+def build_region_index(regions):
+    """建立/24网段(IP整数右移8位) -> 所属地区名元组的索引"""
+    index = {}
+    for name, region in regions.items():
+        for subnet in iter_subnets_24(region['prefixes']):
+            key = int(subnet.network_address) >> 8
+            index[key] = index.get(key, ()) + (name,)
+    return index
+
+def prefix_key(ip):
+    """IP所在的/24(IPv6为/48)，用作调度时的分组键"""
+    if ':' in ip:
+        return ipaddress.IPv6Address(ip).exploded[:14]
+    return ip.rsplit('.', 1)[0]
+
+class ProbePacer:
+    """探测调度器: 全局令牌桶限速 + 每个/24的在途探测上限 + 跨网段随机交错
+
+    IP按/24分组后随机打乱，调度时在各网段之间轮转取IP，避免连续的SYN集中打到同一网段。
+    每个IP要测多个端口时，同一IP最多per_host个端口同时在途，其余端口在归还后再派发。
+    本类不做任何等待，由各探测引擎按delay()/next_target()的结果自行等待。
+    """
+    
+    def __init__(self, ips, rate=0, per_prefix=0, seed=None, ports=None, per_host=1):
+        rng = random.Random(seed)
+        groups = {}
+        for ip in ips:
+            groups.setdefault(prefix_key(ip), []).append(ip)
+        for group in groups.values():
+            rng.shuffle(group)
+        order = list(groups)
+        rng.shuffle(order)
+        self.groups = {key: deque(groups[key]) for key in order}
+        self.ready = deque(order)     # 可以继续派发的网段(轮转)
+        self.blocked = set()          # 在途数已达上限的网段
+        self.inflight = {}
+        self.ports = list(ports or [TEST_PORT])
+        self.pending = sum(len(group) for group in self.groups.values()) * len(self.ports)
+        self.rate = rate
+        self.per_prefix = per_prefix
+        # 多端口时每个IP剩余的端口，以及在途数已达per_host而暂时移出分组的IP
+        self.per_host = max(1, per_host)
+        self.ports_left = {} if len(self.ports) > 1 else None
+        self.host_inflight = {}
+        self.parked = set()
+        # 令牌桶容量为50毫秒的配额，允许小批量发出
+        self.capacity = max(1.0, rate / 20) if rate else 0
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+    
+    def exhausted(self):
+        """所有IP都已派发"""
+        return self.pending == 0
+    
+    def has_ready(self):
+        """是否有未被在途上限阻塞的网段"""
+        return bool(self.ready)
+    
+    def delay(self):
+        """距离下一个令牌可用还需等待的秒数，不限速时总是0"""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def next_target(self):
+        """取出下一个可派发的(IP, 端口)并消耗一个令牌；没有令牌或所有网段都被阻塞时返回None"""
+        if not self.ready or self.delay() > 0:
+            return None
+        key = self.ready.popleft()
+        group = self.groups[key]
+        ip = group.popleft()
+        port = self.ports[0]
+        if self.ports_left is not None:
+            ports = self.ports_left.get(ip)
+            if ports is None:
+                ports = self.ports_left[ip] = deque(self.ports)
+            port = ports.popleft()
+            hosts = self.host_inflight.get(ip, 0) + 1
+            self.host_inflight[ip] = hosts
+            if not ports:
+                del self.ports_left[ip]
+            elif hosts < self.per_host:
+                group.append(ip)   # 排到网段末尾，与同网段的其他IP交错
+            else:
+                self.parked.add(ip)
+        self.pending -= 1
+        if self.rate:
+            self.tokens -= 1
+        count = self.inflight.get(key, 0) + 1
+        self.inflight[key] = count
+        if not group:
+            del self.groups[key]
+        elif self.per_prefix and count >= self.per_prefix:
+            self.blocked.add(key)
+        else:
+            self.ready.append(key)
+        return ip, port
+    
+    def release(self, target):
+        """探测完成后归还该网段(和该IP)的在途名额"""
+        ip = target[0]
+        key = prefix_key(ip)
+        count = self.inflight[key] - 1
+        if count:
+            self.inflight[key] = count
+        else:
+            del self.inflight[key]
+        if self.ports_left is not None:
+            hosts = self.host_inflight[ip] - 1
+            if hosts:
+                self.host_inflight[ip] = hosts
+            else:
+                del self.host_inflight[ip]
+            if ip in self.parked:
+                # 该IP还有端口未测，放回所属网段
+                self.parked.discard(ip)
+                group = self.groups.get(key)
+                if group is not None:
+                    group.append(ip)
+                else:
+                    self.groups[key] = deque([ip])
+                    if key not in self.blocked:
+                        self.ready.append(key)
+        if key in self.blocked:
+            self.blocked.discard(key)
+            self.ready.append(key)
+
+class ProbeResults:
+    """列式保存的探测结果: IP为整数编码，端口，延迟为微秒，时间为相对本次运行起点的毫秒偏移
+
+    IPv4编码为uint32，IPv6编码为V6_BASE加其在v6_addrs中的序号。每条结果约19字节，
+    探测时不分配字典，需要输出时再通过record()生成字典。
+    """
+    __slots__ = ('epoch', 'started', 'ips', 'ports', 'latency_us', 'status', 'offset_ms', 'v6_addrs', 'v6_ids')
+    
+    V6_BASE = 1 << 32  # 不小于此值的编码表示IPv6地址
+    
+    OK = 0       # 连接成功
+    FAILED = 1   # 连接被拒绝或超时
+    ERROR = 2    # 探测过程出现异常
+    
+    def __init__(self):
+        self.epoch = time.time()          # 本次运行起点(墙上时间)
+        self.started = time.monotonic()   # 本次运行起点(单调时钟)
+        self.ips = array('Q')
+        self.ports = array('H')
+        self.latency_us = array('i')      # -1表示不可达
+        self.status = array('B')
+        self.offset_ms = array('I')
+        self.v6_addrs = []                # 出现过的IPv6地址
+        self.v6_ids = {}                  # IPv6地址 -> 编码
+    
+    def __len__(self):
+        return len(self.status)
+    
+    def encode(self, ip, add=True):
+        """IP的整数编码；add为False且该IPv6地址未出现过时返回None"""
+        if ':' not in ip:
+            return int.from_bytes(socket.inet_aton(ip), 'big')
+        code = self.v6_ids.get(ip)
+        if code is None and add:
+            code = self.v6_ids[ip] = self.V6_BASE + len(self.v6_addrs)
+            self.v6_addrs.append(ip)
+        return code
+    
+    def append(self, ip, port, response_time, status):
+        """追加一条结果，response_time为毫秒(None表示不可达)，返回其下标"""
+        self.ips.append(self.encode(ip))
+        self.ports.append(port)
+        self.latency_us.append(-1 if response_time is None else int(response_time * 1000))
+        self.status.append(status)
+        self.offset_ms.append(int((time.monotonic() - self.started) * 1000))
+        return len(self.status) - 1
+    
+    def extend(self, other):
+        """合并另一个结果集(如分片进程返回的)，时间偏移换算到本结果集的起点"""
+        shift = int((other.epoch - self.epoch) * 1000)
+        if other.v6_addrs:
+            # IPv6编码换算为本结果集的编码
+            codes = [self.encode(ip) for ip in other.v6_addrs]
+            self.ips.extend(array('Q', (v if v < self.V6_BASE else codes[v - self.V6_BASE] for v in other.ips)))
+        else:
+            self.ips.extend(other.ips)
+        self.ports.extend(other.ports)
+        self.latency_us.extend(other.latency_us)
+        self.status.extend(other.status)
+        self.offset_ms.extend(array('I', (max(0, offset + shift) for offset in other.offset_ms)))
+    
+    def ip(self, i):
+        value = self.ips[i]
+        if value >= self.V6_BASE:
+            return self.v6_addrs[value - self.V6_BASE]
+        return socket.inet_ntoa(value.to_bytes(4, 'big'))
+    
+    def latency_ms(self, i):
+        """整数毫秒延迟，不可达时为None"""
+        us = self.latency_us[i]
+        return None if us < 0 else us // 1000
+    
+    def timestamp(self, i):
+        return datetime.fromtimestamp(self.epoch + self.offset_ms[i] / 1000).isoformat()
+    
+    def record(self, i):
+        """生成与其他地方一致的结果字典"""
+        latency = self.latency_ms(i)
+        return {
+            'ip': self.ip(i),
+            'port': self.ports[i],
+            'reachable': latency is not None,
+            'response_time_ms': latency,
+            'timestamp': self.timestamp(i)
+        }
+    
+    def reachable_order(self, start=0):
+        """可达结果的下标，按延迟升序"""
+        latency = self.latency_us
+        return sorted((i for i in range(start, len(latency)) if latency[i] >= 0), key=latency.__getitem__)
+    
+    def endpoint(self, i):
+        """第i条结果的(IP编码, 端口)，用于按节点分组"""
+        return self.ips[i], self.ports[i]
+    
+    def ip_order(self, start=0):
+        """按(IP, 端口)分组的下标(同一分组内保持时间顺序)"""
+        return sorted(range(start, len(self.ips)), key=self.endpoint)
+    
+    def records(self, indices=None):
+        """按给定下标(默认全部)逐条生成结果字典，用于导出"""
+        for i in range(len(self)) if indices is None else indices:
+            yield self.record(i)
+
+class IPHistory:
+    """按IP保存的跨运行历史: 延迟和成功率的指数加权移动平均(EWMA)
+
+    文件中每个IP保存为 [延迟EWMA毫秒(从未成功为null), 成功率EWMA, 测试次数, 最后测试时间]。
+    """
+    
+    def __init__(self, path, alpha):
+        self.path = path if os.path.isabs(path) else os.path.join(REPO_DIR, path)
+        self.alpha = alpha
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"读取历史文件失败，将重新开始: {e}", file=sys.stderr)
+    
+    def update(self, ip, latency, success, now):
+        """用本次的延迟(失败为None)和成功率(0~1)更新该IP的EWMA"""
+        entry = self.entries.get(ip)
+        if entry is None:
+            self.entries[ip] = [None if latency is None else round(latency, 1), round(success, 3), 1, now]
+            return
+        ewma_latency, ewma_success, runs, _ = entry
+        a = self.alpha
+        if latency is not None:
+            ewma_latency = latency if ewma_latency is None else (1 - a) * ewma_latency + a * latency
+        ewma_success = (1 - a) * ewma_success + a * success
+        self.entries[ip] = [
+            None if ewma_latency is None else round(ewma_latency, 1),
+            round(ewma_success, 3), runs + 1, now
+        ]
+    
+    def score(self, ip):
+        """综合评分(毫秒，越小越好): 延迟EWMA加上按成功率计算的惩罚"""
+        entry = self.entries.get(ip)
+        if entry is None or entry[0] is None:
+            return float('inf')
+        return entry[0] + HISTORY_FAIL_PENALTY * (1 - entry[1])
+    
+    def best(self, count, where=None):
+        """返回综合评分最好的count个IP(不含从未成功过的)，where用于按IP过滤"""
+        scored = [ip for ip, entry in self.entries.items()
+                  if entry[0] is not None and (where is None or where(ip))]
+        return heapq.nsmallest(count, scored, key=self.score)
+    
+    def save(self, now):
+        """移除过期的IP，只保留评分最好的HISTORY_MAX_ENTRIES个，原子地写回文件"""
+        fresh = {ip: entry for ip, entry in self.entries.items() if now - entry[3] <= HISTORY_MAX_AGE}
+        if len(fresh) > HISTORY_MAX_ENTRIES:
+            keep = sorted(fresh, key=self.score)[:HISTORY_MAX_ENTRIES]
+            fresh = {ip: fresh[ip] for ip in keep}
+        self.entries = fresh
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(fresh, f, separators=(',', ':'), sort_keys=True)
+            f.write('\n')
+        os.replace(tmp_path, self.path)
+
+class TopKRanker:
+    """流式前K名: 用大小为K的堆保留延迟最低的可达结果，不可达结果只计数不保存
+
+    结果到达时即更新，内存占用与测试的IP总数无关。
+    """
+    
+    def __init__(self, k):
+        self.k = k
+        self.heap = []                 # (-延迟, 序号, 结果)，堆顶是保留结果中最慢的
+        self.counter = itertools.count()
+        self.reachable = 0
+        self.unreachable = 0
+    
+    def add(self, result, keep=True):
+        """加入一条结果，keep为False时只计入可达/不可达数"""
+        if not result['reachable'] or result['response_time_ms'] is None:
+            self.unreachable += 1
+            return
+        self.reachable += 1
+        if not keep:
+            return
+        item = (-result['response_time_ms'], -next(self.counter), result)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+    
+    def accepts(self, latency):
+        """延迟为latency的可达结果能否进入前K名，用于避免为落选结果生成字典"""
+        return len(self.heap) < self.k or -latency > self.heap[0][0]
+    
+    def sorted(self):
+        """按延迟升序返回保留的结果(延迟相同时先到的在前)"""
+        return [item[2] for item in sorted(self.heap, reverse=True)]
+    
+    def __len__(self):
+        return len(self.heap)
+
+# Cloudflare节点测试类
+class CloudflareNodeTester:
+    def __init__(self):
+        self.nodes = set()  # 存储节点IP，使用set避免重复
+        self.store = ProbeResults()  # 所有单次探测的原始结果(列式保存)
+        self.ranker = TopKRanker(max(RESULT_POOL, TOP_NODES, TLS_CANDIDATES))  # 流式保留最快的结果
+        self.tested = 0            # 已完成的探测次数
+        self.collecting_samples = False  # 多次采样期间原始结果只写入store，结束后再合并
+        self.on_result = None      # 每条最终结果的回调(自适应扫描用于给网段打分)
+        self.lock = threading.Lock()
+        self.probe_rate = PROBE_RATE  # 分片进程只分到全局限速的一部分
+        self.history = IPHistory(HISTORY_FILE, HISTORY_ALPHA) if HISTORY_FILE else None
+        self.region_index = build_region_index(REGIONS)  # /24 -> 所属地区
+        self.region_v6 = [(network, name) for name, region in REGIONS.items()
+                          for network in iter_ipv6_networks(region['prefixes'])]  # 地区的IPv6网段
+        self.region_rankers = {name: TopKRanker(max(RESULT_POOL, region['top']))
+                               for name, region in REGIONS.items()}  # 每个地区单独保留最快的结果
+        # 总榜只收录get_ip_ranges()中的IP；没有地区时扫描的都是总榜网段，不需要过滤
+        self.main_index = PrefixIndex(self.get_ip_ranges()) if REGIONS else None
+    
+    def get_ip_ranges(self):
+        """返回要测试的Cloudflare IP段"""
+
+        
+        # 常见的Cloudflare IP段
+        ip_ranges = [
+"172.64.229.0/24",
+"104.16.0.0/24",
+"104.17.0.0/24",
+"104.18.0.0/24",
+"104.19.0.0/24",
+"104.20.0.0/24",
+"104.21.0.0/24",
+"104.24.0.0/24",
+"104.25.0.0/24",
+"104.26.0.0/24",
+"104.27.0.0/24",
+"162.159.0.0/24",
+"188.114.96.0/24",
+"103.21.244.0/24",
+"108.162.192.0/24",
+"173.245.48.0/24",
+"103.22.200.0/24",
+"103.31.4.0/24",
+"141.101.64.0/24",
+"190.93.240.0/24",
+"197.234.240.0/24",
+"198.41.128.0/24",
+"162.158.0.0/24",
+"172.64.0.0/24",
+"172.64.128.0/24",
+"172.64.192.0/24",
+"172.64.224.0/24",
+"172.64.230.0/24",
+"172.64.232.0/24",
+"172.64.240.0/24",
+"172.64.248.0/24",
+"172.65.0.0/24",
+"172.66.0.0/24",
+"172.67.0.0/24",
+"131.0.72.0/24"
+        ]
+        
+        # 指定了网段文件时使用文件中的网段
+        if PREFIX_FILE:
+            ip_ranges = load_prefix_file(PREFIX_FILE)
+        return ip_ranges + list(IPV6_PREFIXES)
+    
+    def scan_ranges(self):
+        """本次扫描的全部网段: 总榜网段加上各地区的网段，合并去重后每个网段只测一次"""
+        ip_ranges = self.get_ip_ranges() if MAIN_OUTPUT else []
+        ip_ranges += [prefix for region in REGIONS.values() for prefix in region['prefixes']]
+        return [str(network) for network in PrefixIndex(ip_ranges).networks()]
+    
+    def regions_of(self, ip):
+        """IP(字符串或store中的整数编码)所属的地区名元组"""
+        if isinstance(ip, int):
+            if ip < ProbeResults.V6_BASE:
+                return self.region_index.get(ip >> 8, ())
+            ip = self.store.v6_addrs[ip - ProbeResults.V6_BASE]
+        if ':' in ip:
+            if not self.region_v6:
+                return ()
+            address = ipaddress.IPv6Address(ip)
+            return tuple(name for network, name in self.region_v6 if address in network)
+        return self.region_index.get(int.from_bytes(socket.inet_aton(ip), 'big') >> 8, ())
+    
+    def in_main(self, ip):
+        """IP(字符串或store中的整数编码)是否属于总榜的网段"""
+        if self.main_index is None:
+            return True
+        if isinstance(ip, int):
+            if ip < ProbeResults.V6_BASE:
+                return self.main_index.find_value(ip, 4) is not None
+            ip = self.store.v6_addrs[ip - ProbeResults.V6_BASE]
+        return self.main_index.contains(ip)
+    
+    def fetch_known_nodes(self):
+        """从IP段中获取待测试的Cloudflare节点IP"""
+        # 从每个/24分层随机抽取示例IP
+        seed = sample_seed()
+        print(f"抽样种子: {seed}", file=sys.stderr)
+        if MAIN_OUTPUT:
+            self.nodes.update(sample_prefix_hosts(self.get_ip_ranges(), HOSTS_PER_24, seed))
+        # 各地区按各自的抽样密度抽取
+        for region in REGIONS.values():
+            self.nodes.update(sample_prefix_hosts(region['prefixes'], region['hosts_per_24'], seed))
+    
+    def warm_start_scan(self):
+        """热启动扫描: 先复测历史中评分最好的WARM_START_TOP个IP，再从本次抽样的候选中
+        随机探索EXPLORE_FRACTION比例的新IP；没有历史时返回False，由调用方做完整扫描"""
+        if self.history is None:
+            return False
+        # 只扫描地区时，只复测属于这些地区的历史IP
+        where = None if MAIN_OUTPUT else (lambda ip: bool(self.regions_of(ip)))
+        previous = self.history.best(WARM_START_TOP, where)
+        if not previous:
+            return False
+        # 每个地区也复测各自历史最好的IP，避免地区结果被全局最快的IP挤掉
+        known = set(previous)
+        for name, region in REGIONS.items():
+            known.update(self.history.best(region['top'], lambda ip: name in self.regions_of(ip)))
+        self.fetch_known_nodes()
+        candidates = sorted(self.nodes - known)
+        explore = min(len(candidates), math.ceil(len(self.nodes) * EXPLORE_FRACTION))
+        rng = random.Random(f"{sample_seed()}/explore")
+        fresh = rng.sample(candidates, explore)
+        print(f"热启动: 复测历史IP {len(known)} 个, 探索新IP {len(fresh)} 个", file=sys.stderr)
+        
+        # 1. 先复测历史最好的IP
+        self.nodes = known
+        self.test_all_nodes()
+        # 2. 再探索新候选
+        self.nodes = set(fresh)
+        self.test_all_nodes()
+        self.nodes = known | self.nodes
+        return True
+    
+    def adaptive_scan(self):
+        """两阶段自适应扫描: 先每个/24粗筛少量主机，再逐轮淘汰较慢的一半网段，把剩余预算集中到幸存网段
+
+        网段得分取其已测主机中的最低延迟；整个过程的探测总数不超过PROBE_BUDGET，
+        多端口或多次采样时每个IP按 端口数×SAMPLES_PER_IP 次探测计入预算。
+        """
+        seed = sample_seed()
+        print(f"抽样种子: {seed}", file=sys.stderr)
+        rng = random.Random(f"{seed}/adaptive")
+        subnets = list(iter_subnets_24(self.scan_ranges()))
+        budget = PROBE_BUDGET
+        cost = len(probe_ports()) * max(1, SAMPLES_PER_IP)  # 每个IP的探测次数
+        
+        # 预算不足以粗筛全部网段时，随机选取部分网段
+        screen = max(1, SCREEN_HOSTS_PER_24)
+        if len(subnets) * screen * cost > budget:
+            subnets = rng.sample(subnets, max(1, budget // (screen * cost)))
+        
+        tested = set()   # 已测试的IP
+        best = {}        # 网段 -> 最低延迟(ms)
+        owner = {}       # IP -> 所属网段
+        
+        def observe(result):
+            if result['reachable']:
+                subnet = owner[result['ip']]
+                best[subnet] = min(best.get(subnet, result['response_time_ms']), result['response_time_ms'])
+        
+        def probe(ips):
+            ips = [ip for ip in ips if ip not in tested]
+            tested.update(ips)
+            self.nodes = set(ips)
+            self.test_all_nodes()
+            return len(ips) * cost
+        
+        self.on_result = observe
+        
+        # 1. 粗筛
+        screening = []
+        for subnet in subnets:
+            for ip in sample_subnet_hosts(subnet, screen, seed):
+                owner[ip] = subnet
+                screening.append(ip)
+        budget -= probe(screening)
+        
+        # 2. 逐轮减半: 不可达的网段直接淘汰
+        survivors = sorted(best, key=best.get)
+        rounds = max(1, (len(survivors) - 1).bit_length())
+        for i in range(rounds):
+            if budget <= 0 or not survivors:
+                break
+            survivors = survivors[:max(1, (len(survivors) + 1) // 2)]
+            per_subnet = max(1, budget // cost // (rounds - i) // len(survivors))
+            batch = []
+            for subnet in survivors:
+                base = int(subnet.network_address)
+                low, high = host_range(subnet)
+                offsets = list(range(low, high))
+                rng.shuffle(offsets)
+                picked = 0
+                for offset in offsets:
+                    if picked >= per_subnet or (len(batch) + 1) * cost > budget:
+                        break
+                    ip = str(ipaddress.IPv4Address(base + offset))
+                    if ip not in tested:
+                        owner[ip] = subnet
+                        batch.append(ip)
+                        picked += 1
+            if not batch:
+                break
+            budget -= probe(batch)
+            survivors.sort(key=best.get)
+            print(f"第{i + 1}轮: 保留 {len(survivors)} 个网段, 剩余预算 {budget}", file=sys.stderr)
+        
+        self.on_result = None
+        self.nodes = tested
+    
+    def build_result(self, ip, response_time, port=None):
+        """由毫秒延迟构造测试结果，response_time为None表示不可达"""
+        return {
+            'ip': ip,
+            'port': port or TEST_PORT,
+            'reachable': response_time is not None,
+            'response_time_ms': None if response_time is None else int(response_time),
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def measure_connect(self, ip, port=None):
+        """测量一次TCP连接耗时，返回(毫秒延迟或None, 状态码)"""
+        try:
+            start_time = time.perf_counter()
+            # 创建socket连接
+            with socket.socket(ip_family(ip), socket.SOCK_STREAM) as s:
+                s.settimeout(TEST_TIMEOUT)
+                result = s.connect_ex((ip, port or TEST_PORT))
+                if result == 0:  # 连接成功
+                    return (time.perf_counter() - start_time) * 1000, ProbeResults.OK  # 转换为毫秒
+                return None, ProbeResults.FAILED
+        except Exception:
+            return None, ProbeResults.ERROR
+    
+    def test_node_speed(self, ip, port=None):
+        """测试单个节点的连接速度"""
+        response_time, _ = self.measure_connect(ip, port)
+        return self.build_result(ip, response_time, port)
+    
+    def add_result(self, result):
+        """把一条最终结果(多次采样已合并)交给总榜(仅限总榜网段)和所属地区的流式排名"""
+        self.ranker.add(result, keep=self.in_main(result['ip']))
+        for name in self.regions_of(result['ip']):
+            self.region_rankers[name].add(result)
+        if self.on_result is not None:
+            self.on_result(result)
+    
+    def add_probe(self, index):
+        """把store中的单次探测结果交给流式排名，只有可能进入前K名(或有回调)时才生成字典"""
+        if self.on_result is None:
+            latency = self.store.latency_ms(index)
+            if latency is None:
+                self.ranker.unreachable += 1
+                return
+            code = self.store.ips[index]
+            if not (self.ranker.accepts(latency) and self.in_main(code)) and not any(
+                    self.region_rankers[name].accepts(latency)
+                    for name in self.regions_of(code)):
+                self.ranker.reachable += 1
+                return
+        self.add_result(self.store.record(index))
+    
+    def record_probe(self, target, response_time, status):
+        """保存探测引擎返回的单次测试结果(target为(IP, 端口))并定期打印进度"""
+        with self.lock:
+            index = self.store.append(*target, response_time, status)
+            self.tested += 1
+            if not self.collecting_samples:
+                self.add_probe(index)
+            # 每完成360个测试，打印进度(输出到stderr，避免混入结果文件)
+            if self.tested % 360 == 0:
+                print(f"已测试 {self.tested} 个", file=sys.stderr)
+    
+    def worker(self, pacer, cond):
+        """线程工作函数，从调度器领取(IP, 端口)，领取和归还都在cond保护下进行"""
+        while True:
+            with cond:
+                while True:
+                    if pacer.exhausted():
+                        return
+                    target = pacer.next_target()
+                    if target is not None:
+                        break
+                    # 等待令牌，或等待其他线程归还网段名额
+                    cond.wait(pacer.delay() or None)
+            try:
+                self.record_probe(target, *self.measure_connect(*target))
+            finally:
+                with cond:
+                    pacer.release(target)
+                    cond.notify_all()
+    
+    async def async_measure_connect(self, ip, port=None):
+        """使用非阻塞socket异步测量一次TCP连接耗时，返回(毫秒延迟或None, 状态码)"""
+        loop = asyncio.get_running_loop()
+        try:
+            with socket.socket(ip_family(ip), socket.SOCK_STREAM) as s:
+                s.setblocking(False)
+                start_time = time.perf_counter()
+                try:
+                    await asyncio.wait_for(loop.sock_connect(s, (ip, port or TEST_PORT)), TEST_TIMEOUT)
+                except (asyncio.TimeoutError, OSError):
+                    # 超时或被拒绝，与connect_ex返回非0的情况一致
+                    return None, ProbeResults.FAILED
+                return (time.perf_counter() - start_time) * 1000, ProbeResults.OK  # 转换为毫秒
+        except Exception:
+            return None, ProbeResults.ERROR
+    
+    async def async_test_all_nodes(self, pacer):
+        """用固定数量的协程共享同一个调度器，最多保持MAX_CONCURRENCY个连接同时进行"""
+        released = asyncio.Event()
+        
+        async def runner():
+            while not pacer.exhausted():
+                target = pacer.next_target()
+                if target is None:
+                    delay = pacer.delay()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        # 所有网段都达到在途上限，等待有探测完成
+                        released.clear()
+                        await released.wait()
+                    continue
+                try:
+                    self.record_probe(target, *await self.async_measure_connect(*target))
+                finally:
+                    pacer.release(target)
+                    released.set()
+        
+        concurrency = raise_nofile_limit(min(MAX_CONCURRENCY, len(self.nodes) * len(pacer.ports)))
+        await asyncio.gather(*(runner() for _ in range(concurrency)))
+    
+    def selector_test_all_nodes(self, pacer):
+        """单线程非阻塞socket + selectors(epoll)批量扫描，每个探测的状态保存在平坦数组中"""
+        slots = raise_nofile_limit(min(MAX_CONCURRENCY, len(self.nodes) * len(pacer.ports)))
+        linger = struct.pack('ii', 1, 0)  # 关闭时直接发RST，避免大量TIME_WAIT占用本地端口
+        
+        # 槽位状态: 当前探测的序号、发出connect的时间、socket对象、(IP, 端口)
+        slot_probe = array('l', [-1]) * slots
+        slot_start = array('d', [0.0]) * slots
+        slot_sock = [None] * slots
+        slot_target = [None] * slots
+        free_slots = list(range(slots))
+        # 按发出顺序排列的(槽位, 探测序号)，超时时间相同，所以队首总是最早到期
+        order_slot = deque()
+        order_probe = deque()
+        
+        sel = selectors.DefaultSelector()
+        
+        def finish(slot, response_time):
+            s = slot_sock[slot]
+            sel.unregister(s)
+            s.close()
+            target = slot_target[slot]
+            slot_sock[slot] = None
+            slot_target[slot] = None
+            slot_probe[slot] = -1
+            free_slots.append(slot)
+            pacer.release(target)
+            if response_time is None:
+                self.record_probe(target, None, ProbeResults.FAILED)
+            else:
+                self.record_probe(target, response_time, ProbeResults.OK)
+        
+        next_probe = 0
+        try:
+            while not pacer.exhausted() or order_slot:
+                # 1. 批量发出新的connect
+                for _ in range(min(CONNECT_BATCH, len(free_slots))):
+                    target = pacer.next_target()
+                    if target is None:
+                        break
+                    s = socket.socket(ip_family(target[0]), socket.SOCK_STREAM)
+                    s.setblocking(False)
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, linger)
+                    start_time = time.perf_counter()
+                    err = s.connect_ex(target)
+                    if err not in CONNECT_PENDING:
+                        s.close()
+                        pacer.release(target)
+                        self.record_probe(target, None, ProbeResults.FAILED)
+                        continue
+                    slot = free_slots.pop()
+                    slot_probe[slot] = next_probe
+                    slot_start[slot] = start_time
+                    slot_sock[slot] = s
+                    slot_target[slot] = target
+                    sel.register(s, selectors.EVENT_WRITE, slot)
+                    order_slot.append(slot)
+                    order_probe.append(next_probe)
+                    next_probe += 1
+                
+                # 2. 等待可写事件；还能继续派发时最多等到下一个令牌可用
+                if free_slots and pacer.has_ready():
+                    wait = pacer.delay()
+                elif order_slot:
+                    wait = max(0.0, slot_start[order_slot[0]] + TEST_TIMEOUT - time.perf_counter())
+                else:
+                    continue
+                if not order_slot:
+                    time.sleep(wait)
+                    continue
+                for key, _ in sel.select(wait):
+                    now = time.perf_counter()
+                    slot = key.data
+                    err = slot_sock[slot].getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    finish(slot, (now - slot_start[slot]) * 1000 if err == 0 else None)
+                
+                # 3. 清理已完成的队首记录并让超时的探测失败
+                now = time.perf_counter()
+                while order_slot:
+                    slot = order_slot[0]
+                    if slot_probe[slot] != order_probe[0]:
+                        # 该槽位已完成(可能已被复用)
+                        order_slot.popleft()
+                        order_probe.popleft()
+                        continue
+                    if now - slot_start[slot] < TEST_TIMEOUT:
+                        break
+                    order_slot.popleft()
+                    order_probe.popleft()
+                    finish(slot, None)
+        finally:
+            for s in slot_sock:
+                if s is not None:
+                    s.close()
+            sel.close()
+    
+    def summarize_samples(self, indices):
+        """把store中同一IP的多次采样(按时间顺序的下标)合并为一条结果，记录min/median/p95、抖动和丢包率"""
+        store = self.store
+        latencies = [store.latency_ms(i) for i in indices if store.latency_us[i] >= 0]
+        result = {
+            'ip': store.ip(indices[0]),
+            'port': store.ports[indices[0]],
+            'reachable': bool(latencies),
+            'response_time_ms': None,
+            'timestamp': store.timestamp(indices[-1]),
+            'loss': round(1 - len(latencies) / len(indices), 3)
+        }
+        if latencies:
+            ordered = sorted(latencies)
+            result['min_ms'] = ordered[0]
+            result['median_ms'] = int(statistics.median(ordered))
+            result['p95_ms'] = ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)]
+            # 抖动: 相邻两次采样延迟差的平均值
+            diffs = [abs(b - a) for a, b in zip(latencies, latencies[1:])]
+            result['jitter_ms'] = int(sum(diffs) / len(diffs)) if diffs else 0
+            result['response_time_ms'] = result[f'{RANK_STAT}_ms']
+        return result
+    
+    def test_all_nodes(self):
+        """测试所有节点的速度，节点较多且开启了分片时分到多个进程并行测试"""
+        if not self.nodes:
+            return
+        processes = SHARD_PROCESSES or os.cpu_count() or 1
+        if processes > 1 and len(self.nodes) >= SHARD_MIN_NODES:
+            self.test_nodes_sharded(processes)
+        else:
+            self.test_local_nodes()
+    
+    def test_nodes_sharded(self, processes):
+        """把节点交错分成多个分片，每个进程测试一个分片，合并各分片的前K名"""
+        nodes = list(self.nodes)
+        shards = [nodes[i::processes] for i in range(processes)]
+        rates = [self.probe_rate / processes] * processes
+        settings = {name: globals()[name] for name in SHARD_SETTINGS}
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for top_results, region_results, store, reachable, unreachable in executor.map(
+                    scan_shard, shards, rates, [settings] * processes):
+                self.store.extend(store)
+                self.tested += len(store)
+                for result in top_results:
+                    self.ranker.add(result, keep=self.in_main(result['ip']))
+                if self.on_result is not None:
+                    # 回调需要看到每个可达结果(自适应扫描据此给网段打分)，分片只返回前K名，从原始结果补齐
+                    for i in store.reachable_order():
+                        self.on_result(store.record(i))
+                # 地区结果单独合并，与全局结果共用同一个字典
+                for name, results in region_results.items():
+                    for result in results:
+                        self.region_rankers[name].add(result)
+                # 分片内未返回的可达结果和不可达结果只合并计数
+                self.ranker.reachable += reachable - len(top_results)
+                self.ranker.unreachable += unreachable
+        print(f"{processes}个分片共测试 {self.tested} 个，保留可达节点 {len(self.ranker)} 个", file=sys.stderr)
+    
+    def test_local_nodes(self):
+        """在当前进程中测试所有节点，SAMPLES_PER_IP大于1时分多轮采样并合并统计"""
+        if SAMPLES_PER_IP <= 1:
+            self.run_probe_engine()
+            return
+        
+        start = len(self.store)
+        self.collecting_samples = True
+        try:
+            for i in range(SAMPLES_PER_IP):
+                round_start = time.monotonic()
+                self.run_probe_engine()
+                if i < SAMPLES_PER_IP - 1:
+                    time.sleep(max(0.0, SAMPLE_INTERVAL - (time.monotonic() - round_start)))
+        finally:
+            self.collecting_samples = False
+        
+        # 按(IP, 端口)合并本次的所有采样
+        for _, group in itertools.groupby(self.store.ip_order(start), key=self.store.endpoint):
+            self.add_result(self.summarize_samples(list(group)))
+    
+    def run_probe_engine(self):
+        """用PROBE_ENGINE指定的引擎把所有节点测试一遍"""
+        pacer = ProbePacer(self.nodes, self.probe_rate, PREFIX_INFLIGHT, f"{sample_seed()}/pacer",
+                           probe_ports(), HOST_INFLIGHT)
+        if PROBE_ENGINE == "asyncio":
+            asyncio.run(self.async_test_all_nodes(pacer))
+            return
+        if PROBE_ENGINE == "selectors":
+            self.selector_test_all_nodes(pacer)
+            return
+        if PROBE_ENGINE != "thread":
+            raise ValueError(f"未知的探测引擎: {PROBE_ENGINE}")
+        
+        # 启动线程
+        cond = threading.Condition()
+        threads = []
+        for _ in range(min(MAX_THREADS, len(self.nodes))):
+            thread = threading.Thread(target=self.worker, args=(pacer, cond))
+            thread.start()
+            threads.append(thread)
+        
+        # 等待所有线程完成
+        for thread in threads:
+            thread.join()
+        
+
+    
+    async def async_tls_probe_node(self, node, context):
+        """对单个节点做TLS握手，把握手耗时记录到tls_time_ms(失败为None)
+
+        同一连接上按需获取colo/loc、发送HEAD请求测往返时间，最后读取内核统计的RTT。
+        """
+        try:
+            reader, writer, _, tls_time = await open_tls_session(
+                node['ip'], node.get('port', TEST_PORT), TLS_SNI, TEST_TIMEOUT, context
+            )
+        except (asyncio.TimeoutError, OSError, ssl.SSLError) as e:
+            node['tls_time_ms'] = None
+            node['tls_error'] = str(e) or type(e).__name__
+            return
+        node['tls_time_ms'] = int(tls_time)
+        try:
+            if TRACE_PROBE:
+                # 在同一连接上获取实际服务的数据中心
+                trace = await fetch_trace(reader, writer, TLS_SNI, TEST_TIMEOUT)
+                node['colo'] = trace.get('colo')
+                node['loc'] = trace.get('loc')
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                OSError, ValueError, IndexError) as e:
+            node['trace_error'] = str(e) or type(e).__name__
+        try:
+            if HTTP_PINGS and 'trace_error' not in node:
+                pings = []
+                for _ in range(HTTP_PINGS):
+                    pings.append(await http_ping(reader, writer, TLS_SNI, TEST_TIMEOUT))
+                node['ping_ms'] = int(statistics.median(pings))
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                OSError, ValueError, IndexError) as e:
+            node['ping_error'] = str(e) or type(e).__name__
+        finally:
+            if TCP_INFO_PROBE:
+                info = read_tcp_info(writer.get_extra_info('socket'))
+                if info is not None:
+                    node['tcp_rtt_ms'], node['tcp_rttvar_ms'], node['tcp_retrans'] = info
+            await close_session(writer)
+    
+    async def async_tls_probe_nodes(self, nodes):
+        """并发对一组节点做TLS握手测试"""
+        context = make_tls_context()
+        pending = iter(nodes)
+        
+        async def runner():
+            for node in pending:
+                await self.async_tls_probe_node(node, context)
+        
+        await asyncio.gather(*(runner() for _ in range(min(TLS_CONCURRENCY, len(nodes)))))
+    
+    def tls_probe_nodes(self):
+        """对全局和各地区TCP延迟最低的TLS_CANDIDATES个节点做TLS连接测试"""
+        candidates = {}
+        for ranker in (self.ranker, *self.region_rankers.values()):
+            for node in ranker.sorted()[:TLS_CANDIDATES]:
+                candidates[id(node)] = node
+        candidates = list(candidates.values())
+        if candidates:
+            asyncio.run(self.async_tls_probe_nodes(candidates))
+    
+    def is_rankable(self, node):
+        """节点是否参与排名: TCP可达且丢包率不超过MAX_LOSS，启用TLS测试时还要求握手成功，
+        RANK_METRIC对应的指标必须已测得，设置了COLO_FILTER时要求数据中心匹配"""
+        if not node['reachable'] or node['response_time_ms'] is None:
+            return False
+        if node.get('loss', 0) > MAX_LOSS:
+            return False
+        if TLS_PROBE and node.get('tls_time_ms') is None:
+            return False
+        if RANK_METRIC == "kernel_rtt" and node.get('tcp_rtt_ms') is None:
+            return False
+        if RANK_METRIC == "http_ping" and node.get('ping_ms') is None:
+            return False
+        return not COLO_FILTER or node.get('colo') in COLO_FILTER
+    
+    def rank_value(self, node):
+        """排名使用的延迟: 由RANK_METRIC决定；connect在启用TLS测试时为TCP连接与TLS握手之和，即客户端实际等待的时间"""
+        if RANK_METRIC == "kernel_rtt":
+            return node['tcp_rtt_ms']
+        if RANK_METRIC == "http_ping":
+            return node['ping_ms']
+        if TLS_PROBE:
+            return node['response_time_ms'] + node['tls_time_ms']
+        return node['response_time_ms']
+    
+    def speed_test_nodes(self, sorted_nodes):
+        """对延迟排名前SPEED_TEST_TOP的节点依次下载测速，测速成功的节点按速度排在最前"""
+        finalists = sorted_nodes[:SPEED_TEST_TOP]
+        buffer = bytearray(SPEED_BUFFER_SIZE)
+        context = make_tls_context()
+        # 逐个测速，避免节点之间互相抢占带宽
+        for node in finalists:
+            try:
+                node['download_speed'] = download_speed(
+                    node['ip'], node.get('port', TEST_PORT), SPEED_TEST_HOST, SPEED_TEST_PATH, buffer, context
+                )
+            except (OSError, ValueError, IndexError) as e:
+                node['download_speed'] = None
+                node['speed_error'] = str(e) or type(e).__name__
+        
+        measured = [node for node in finalists if node['download_speed']]
+        measured.sort(key=lambda x: x['download_speed'], reverse=True)
+        rest = [node for node in sorted_nodes if not node.get('download_speed')]
+        return measured + rest
+    
+    def node_label(self, node):
+        """输出行中#后的备注，测过速的节点附带MB/s"""
+        if node.get('download_speed'):
+            return f"CF 优选IP-{node['download_speed']:.2f}MB/s"
+        return "CF 优选IP"
+    
+    def update_history(self, now):
+        """用本次结果更新历史: 排名池中的节点用排名延迟，历史中其余本次测过的IP用原始探测结果按同一口径汇总"""
+        updated = set()
+        for node in itertools.chain(self.ranker.sorted(), *(r.sorted() for r in self.region_rankers.values())):
+            if node['ip'] in updated:
+                continue
+            success = 1 - node.get('loss', 0)
+            if TLS_PROBE and 'tls_time_ms' in node and node['tls_time_ms'] is None:
+                success = 0.0  # TLS握手失败视为不可用
+            latency = self.rank_value(node) if self.is_rankable(node) else None
+            self.history.update(node['ip'], latency, success, now)
+            updated.add(node['ip'])
+        
+        # 历史中的其他IP: 按(IP, 端口)汇总本次的采样，取最好的端口，与排名池中的节点口径一致；
+        # 排名指标不是TCP连接延迟时(启用TLS测试或按内核RTT/HEAD往返排名)原始结果没有同单位的值，只更新成功率
+        wanted = {}
+        for ip in self.history.entries:
+            if ip not in updated:
+                code = self.store.encode(ip, add=False)
+                if code is not None:
+                    wanted[code] = ip
+        if not wanted:
+            return
+        store = self.store
+        groups = {}  # IP编码 -> 端口 -> 按时间顺序的下标
+        for i, value in enumerate(store.ips):
+            if value in wanted:
+                groups.setdefault(value, {}).setdefault(store.ports[i], []).append(i)
+        same_metric = RANK_METRIC == "connect" and not TLS_PROBE
+        for value, by_port in groups.items():
+            results = [self.summarize_samples(indices) for indices in by_port.values()]
+            success = max(1 - result['loss'] for result in results)
+            latencies = [result['response_time_ms'] for result in results
+                         if result['reachable'] and result['loss'] <= MAX_LOSS]
+            latency = min(latencies) if same_metric and latencies else None
+            self.history.update(wanted[value], latency, success, now)
+    
+    def rank_nodes(self, nodes):
+        """过滤出可参与排名的节点并按延迟升序排序，有历史时再按综合评分排序，
+        使稳定快速的IP排在偶尔一次很快的IP之前；多端口时每个IP只保留最快的端口"""
+        sorted_nodes = sorted((node for node in nodes if self.is_rankable(node)), key=self.rank_value)
+        if self.history is not None:
+            for node in sorted_nodes:
+                node['score_ms'] = round(self.history.score(node['ip']), 1)
+            sorted_nodes.sort(key=lambda x: x['score_ms'])
+        seen = set()
+        best_ports = []
+        for node in sorted_nodes:
+            if node['ip'] not in seen:
+                seen.add(node['ip'])
+                best_ports.append(node)
+        return best_ports
+    
+    def sort_and_display_results(self):
+        """排序并把前TOP_NODES个节点输出到stdout(地址#备注)"""
+        # 过滤出可参与排名的节点
+        print(f"可达 {self.ranker.reachable} 个，不可达 {self.ranker.unreachable} 个", file=sys.stderr)
+        # 按延迟和历史综合评分排序
+        sorted_nodes = self.rank_nodes(self.ranker.sorted())
+        
+        # 对排名靠前的节点做下载测速
+        if SPEED_TEST:
+            sorted_nodes = self.speed_test_nodes(sorted_nodes)
+        
+        
+        # 显示前N个最快节点
+        for i, node in enumerate(sorted_nodes[:TOP_NODES], 1):
+            print(f"{format_endpoint(node)}#{self.node_label(node)}")
+        
+        return sorted_nodes
+    
+    def save_results(self, results):
+        """只保存前30名结果到TXT文件(地址#备注 延迟)"""
+        try:
+            # 只取前30名结果
+            top_results = results[:300]  # 明确只取前30名
+            
+            with open(TXT_OUTPUT_FILE, 'w', encoding='utf-8') as f:
+                # 清空文件并只写入前30个结果
+                for i, node in enumerate(top_results):
+                    line = f"{format_endpoint(node)}#{self.node_label(node)} {node['response_time_ms']}ms\n"
+                    f.write(line)
+            
+        except Exception as e:
+            print(f"保存结果失败: {e}")
+
+    def save_region_results(self, echo=False):
+        """把各地区的排名结果按各自的模板写入各自的文件，echo为True时同时输出到stdout"""
+        for name, region in REGIONS.items():
+            nodes = self.rank_nodes(self.region_rankers[name].sorted())[:region['top']]
+            lines = [format_region_line(region['template'], node, name) for node in nodes]
+            if echo:
+                for line in lines:
+                    print(line)
+            try:
+                with open(region['file'], 'w', encoding='utf-8') as f:
+                    for line in lines:
+                        f.write(line + '\n')
+            except OSError as e:
+                print(f"保存{name}结果失败: {e}", file=sys.stderr)
+                continue
+            print(f"{name}: 保存 {len(nodes)} 个节点到 {region['file']}", file=sys.stderr)
+
+def scan_shard(ips, rate, settings=None):
+    """分片子进程入口: 先恢复父进程的运行时设置(SHARD_SETTINGS)，再用独立的测试器和事件循环测试一个分片
+
+    返回(保留的最快可达结果, 各地区保留的结果, 列式原始结果, 可达数, 不可达数)。
+    """
+    if settings:
+        globals().update(settings)
+    tester = CloudflareNodeTester()
+    tester.nodes = set(ips)
+    tester.probe_rate = rate
+    tester.test_local_nodes()
+    ranker = tester.ranker
+    region_results = {name: region.sorted() for name, region in tester.region_rankers.items()}
+    return ranker.sorted(), region_results, tester.store, ranker.reachable, ranker.unreachable
+
+# IP地理位置查询功能
+def batch_query_ip_countries():
+    """批量查询IP地址的国家信息(显示中文)"""
+    print("\n===== IP地址国家信息批量查询 =====")
+    
+    # 从cf_IP.txt文件读取IP地址列表
+    try:
+        with open(TXT_OUTPUT_FILE, 'r', encoding='utf-8') as f:
+            ip_list = []
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    # 从格式 "[IPv6]:端口#备注" 中提取IP
+                    ip_list.append(line.split(']', 1)[0] + ']')
+                elif line and not line.startswith('#') and not line.startswith('=') and ':' in line:
+                    # 从格式 "IP:端口#备注" 中提取IP
+                    ip = line.split(':')[0].strip()
+                    ip_list.append(ip)
+                elif line and not line.startswith('#') and not line.startswith('=') and ' ' not in line and '.' in line:
+                    # 纯IP地址行
+                    ip_list.append(line)
+        print(f"从文件读取了 {len(ip_list)} 个IP地址")
+    except Exception as e:
+        print(f"无法从文件读取IP: {str(e)}")
+        print("使用默认IP列表进行演示")
+        # 默认IP列表
+        ip_list = [
+            "108.162.192.3", "108.162.192.7", "108.162.192.4", "108.162.192.9",
+            "162.159.0.4", "162.159.0.1", "162.159.0.3", "108.162.192.2"
+        ]
+    
+    # 清理并验证IP地址列表
+    cleaned_ips = []
+    for ip in ip_list:
+        cleaned_ip = clean_ip(ip)
+        if cleaned_ip:
+            cleaned_ips.append(cleaned_ip)
+        else:
+            print(f"无效的IP地址: {ip}")
+    
+    print(f"清理后有效IP地址数量: {len(cleaned_ips)}")
+    
+    # 批量并发获取国家信息（已经是中文），按各接口的配额调度请求
+    countries = geo_client().lookup(cleaned_ips)
+    results = [f"{ip} {countries[ip]}" for ip in cleaned_ips]
+    
+    # 将结果写入文件
+    with open(IP_COUNTRIES_FILE, 'w', encoding='utf-8') as f:
+        for result in results:
+            f.write(result + '\n')
+    
+    print(f"\n查询完成！结果已保存到 {IP_COUNTRIES_FILE}")
+    print(f"处理的IP地址总数: {len(results)}")
+    
+    # 显示有国家信息的IP数量
+    successful_queries = sum(1 for r in results if not r.endswith(' 未知'))
+    print(f"获取到国家信息的IP数量: {successful_queries}")
+    print("===================================")
+
+# Cloudflare节点测试功能
+def test_cloudflare_nodes():
+    """运行Cloudflare节点测试"""
+    print("\n===== Cloudflare节点测速工具 =====")
+    tester = CloudflareNodeTester()
+    tester.run()
+
+# CloudflareNodeTester类的run方法
+def run_cloudflare_tester(self):
+    """运行整个测试流程"""
+    start_time = time.time()
+    
+    if SCAN_MODE == "adaptive":
+        # 1+2. 粗筛并逐轮细化
+        self.adaptive_scan()
+    elif WARM_START and self.warm_start_scan():
+        # 1+2. 复测历史最好的IP并探索一部分新IP
+        pass
+    else:
+        # 1. 获取节点
+        self.fetch_known_nodes()
+        
+        # 2. 测试所有节点
+        self.test_all_nodes()
+    
+    # 2.1 对TCP最快的候选节点测试TLS握手，并在同一连接上获取数据中心、HEAD往返和内核RTT
+    if TLS_PROBE or TRACE_PROBE or TCP_INFO_PROBE or HTTP_PINGS:
+        self.tls_probe_nodes()
+    
+    # 3. 用本次结果更新历史评分
+    if self.history is not None:
+        self.update_history(int(time.time()))
+    
+    # 4. 排序、显示并保存总榜
+    if MAIN_OUTPUT:
+        sorted_nodes = self.sort_and_display_results()
+        self.save_results(sorted_nodes)
+    
+    # 5. 按地区分别保存(只运行地区配置时同时输出到stdout)
+    self.save_region_results(echo=not MAIN_OUTPUT)
+    
+    # 6. 保存历史评分
+    if self.history is not None:
+        self.history.save(int(time.time()))
+    
+    total_time = int(time.time() - start_time)
+
+# 添加run方法到CloudflareNodeTester类
+CloudflareNodeTester.run = run_cloudflare_tester
+
+def use_profiles(names):
+    """只扫描指定的地区配置: 关闭总榜，并用这些配置的端口、超时和并发数作为本次扫描参数"""
+    global REGIONS, MAIN_OUTPUT, TEST_PORT, TEST_PORTS, TEST_TIMEOUT, MAX_CONCURRENCY, MAX_THREADS
+    unknown = [name for name in names if name not in REGIONS]
+    if unknown:
+        raise ValueError(f"未知的地区配置: {', '.join(unknown)}，可用: {', '.join(REGIONS)}")
+    selected = {name: REGIONS[name] for name in names}
+    port_sets = {tuple(region['ports']) for region in selected.values()}
+    if len(port_sets) > 1:
+        raise ValueError(f"所选地区的端口不同，需分别运行: {sorted(port_sets)}")
+    ports = list(port_sets.pop())
+    REGIONS = selected
+    MAIN_OUTPUT = False
+    TEST_PORT = ports[0]
+    TEST_PORTS = ports if len(ports) > 1 else None
+    TEST_TIMEOUT = max(region['timeout'] for region in selected.values())
+    MAX_CONCURRENCY = MAX_THREADS = min(region['concurrency'] for region in selected.values())
+
+def main(argv=None):
+    """命令行入口: 不带参数时扫描总榜和全部地区，--profile只扫描指定的地区"""
+    global REGIONS
+    parser = argparse.ArgumentParser(description="Cloudflare节点测速")
+    parser.add_argument('--profile', action='append', default=[],
+                        help="只扫描指定的地区配置，可重复，如 --profile US --profile JP")
+    parser.add_argument('--profile-dir', default=PROFILE_DIR, help="地区配置目录")
+    parser.add_argument('--list', action='store_true', help="列出可用的地区配置后退出")
+    args = parser.parse_args(argv)
+    
+    REGIONS = load_profiles(args.profile_dir)
+    if args.list:
+        for name, region in REGIONS.items():
+            print(f"{name}: {len(region['prefixes'])} 个网段 -> {region['file']}")
+        return
+    if args.profile:
+        use_profiles(args.profile)
+    else:
+        # 总榜扫描共用probe_ports()，端口不同的地区需单独运行
+        for name in [name for name, region in REGIONS.items() if region['ports'] != probe_ports()]:
+            print(f"地区{name}的端口为{REGIONS[name]['ports']}，不参与总榜扫描", file=sys.stderr)
+            del REGIONS[name]
+        # 超时和并发在共享扫描中无法按地区区分，只提示
+        for name, region in REGIONS.items():
+            if region['timeout'] != TEST_TIMEOUT or region['concurrency'] != MAX_CONCURRENCY:
+                print(f"地区{name}的timeout={region['timeout']}、concurrency={region['concurrency']}只在--profile时生效，"
+                      f"总榜扫描使用timeout={TEST_TIMEOUT}、concurrency={MAX_CONCURRENCY}", file=sys.stderr)
+    
+    tester = CloudflareNodeTester()
+    tester.run()
+
+# 主函数 - 直接执行Cloudflare节点测试
+if __name__ == "__main__":
+
+    try:
+        # 执行Cloudflare节点测试
+        main()
+        
+    except KeyboardInterrupt:
+        print("\n用户中断了程序")
+    except Exception as e:
+        print(f"程序出错: {e}")
+
+
+
+
+
+
+
+
+
+
+
+
@@ -0,0 +1,360 @@
+"""测量精度基准
+
+在本机启动一个注入延迟的TCP代理: 每个回环目标IP分配一个已知的延迟，代理把后端TLS服务器发往客户端的
+数据按该延迟推迟转发。用各探测引擎在递增的并发下完整跑一遍TCP连接测试和TLS握手测试，把测得的
+延迟与注入的延迟比较，输出误差和排名相关系数，据此判断并发开到多大时排名开始失真。
+
+TCP握手由内核完成，用户态代理无法推迟，因此注入的延迟体现在TLS握手耗时(tls_time_ms)上；
+TCP连接耗时的真实值为回环RTT(约0)，其测得值直接反映探测引擎自身的排队开销。
+代理和后端共用一个进程，高并发时它们自身的排队也会计入TLS误差，因此代理逐个连接记录后端响应耗时
+(转发ClientHello到收到后端首段数据)和自身的转发滞后(实际发出时间减去应发出时间)，报告中从测得值里
+扣除这两部分，得到只归因于测试器的误差(ClientHello在代理读取前的等待无法观测，仍计在测试器一侧，
+因此该值是上限)。
+代理和后端运行在独立进程中，需要openssl命令生成临时自签名证书，依赖Linux的127.0.0.0/8整段回环。
+
+    python py/bench_accuracy.py --targets 1000 --concurrency 10,100,500 --output accuracy.json
+"""
+import os
+import sys
+import ssl
+import time
+import json
+import random
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import All
+from bench_engines import bench_targets, parse_list, BENCH_ENGINES, BENCH_HOSTS_PER_24
+
+# 基准默认参数
+ACCURACY_CONCURRENCY = [10, 50, 200, 1000]  # 并发档位: 同时作用于MAX_THREADS/MAX_CONCURRENCY和TLS_CONCURRENCY
+ACCURACY_TARGETS = 1000     # 目标IP数
+ACCURACY_MAX_DELAY = 200    # 注入延迟的上限(毫秒)，每个目标在[0, 上限]内均匀随机
+ACCURACY_TIMEOUT = 3.0      # 探测超时(秒)，需明显大于注入延迟上限
+ACCURACY_TOP = 20           # 计算前N名重合率时的N
+
+
+def make_certificate(directory):
+    """用openssl生成临时自签名证书，返回(证书路径, 私钥路径)"""
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+         "-nodes", "-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=bench"],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return cert, key
+
+
+async def serve_proxy(delays, cert, key, control):
+    """后端TLS服务器 + 注入延迟的代理；代理按客户端连接的目标IP查延迟，推迟后端到客户端方向的每段数据
+
+    control为与父进程之间的双向管道: 启动后发送代理端口，之后每收到一次请求就回送并清空
+    目标IP -> (后端响应毫秒, 代理转发滞后毫秒) 的统计。
+    """
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+
+    async def backend(reader, writer):
+        try:
+            while await reader.read(65536):
+                pass
+        except (OSError, ssl.SSLError):
+            pass
+        writer.close()
+
+    loop = asyncio.get_running_loop()
+    stats = {}
+
+    async def pump(reader, writer, delay, state, upstream):
+        """转发一个方向的数据；有延迟时每段数据按到达时间加delay发出，读取不受发送等待的影响
+
+        upstream为True时是客户端到后端方向，记录首段数据的转发时间；否则记录后端首段数据的到达时间
+        和每段数据的最大转发滞后。
+        """
+        queue = asyncio.Queue()
+
+        async def receive():
+            try:
+                while True:
+                    data = await reader.read(65536)
+                    if data and not upstream and 'backend_ms' not in state and 'sent' in state:
+                        state['backend_ms'] = (loop.time() - state['sent']) * 1000
+                    queue.put_nowait((loop.time() + delay, data))
+                    if not data:
+                        break
+            except OSError:
+                queue.put_nowait((loop.time(), b''))
+
+        receiver = asyncio.ensure_future(receive())
+        try:
+            while True:
+                due, data = await queue.get()
+                if not data:
+                    break
+                await asyncio.sleep(max(0.0, due - loop.time()))
+                if upstream:
+                    state.setdefault('sent', loop.time())
+                else:
+                    state['lag_ms'] = max(state.get('lag_ms', 0.0), (loop.time() - due) * 1000)
+                writer.write(data)
+                await writer.drain()
+        except OSError:
+            pass
+        finally:
+            receiver.cancel()
+            writer.close()
+
+    async def relay(client_reader, client_writer):
+        target = client_writer.get_extra_info('sockname')[0]
+        delay = delays.get(target, 0) / 1000
+        try:
+            backend_reader, backend_writer = await asyncio.open_connection('127.0.0.1', backend_port)
+        except OSError:
+            client_writer.close()
+            return
+        state = {}
+        await asyncio.gather(pump(client_reader, backend_writer, 0, state, True),
+                             pump(backend_reader, client_writer, delay, state, False))
+        # TCP连接测试的连接没有数据，只统计完成了TLS握手的连接
+        if 'backend_ms' in state:
+            stats[target] = (state['backend_ms'], state.get('lag_ms', 0.0))
+
+    def answer():
+        control.recv()
+        control.send(dict(stats))
+        stats.clear()
+
+    backend_server = await asyncio.start_server(backend, '127.0.0.1', 0, ssl=context, backlog=4096)
+    backend_port = backend_server.sockets[0].getsockname()[1]
+    proxy_server = await asyncio.start_server(relay, '0.0.0.0', 0, backlog=4096)
+    control.send(proxy_server.sockets[0].getsockname()[1])
+    loop.add_reader(control.fileno(), answer)
+    await asyncio.Event().wait()
+
+
+def run_proxy(delays, cert, key, control):
+    """代理子进程入口"""
+    All.raise_nofile_limit(8192)
+    asyncio.run(serve_proxy(delays, cert, key, control))
+
+
+def run_tester(conn, engine, concurrency, targets, port, timeout, verbose):
+    """子进程: 用指定引擎和并发做TCP连接测试和TLS握手测试，把每个节点的测量值发回父进程"""
+    if not verbose:
+        sys.stderr = open(os.devnull, 'w')  # 探测进度打印到stderr，基准时丢弃
+    All.PROBE_ENGINE = engine
+    All.MAX_THREADS = All.MAX_CONCURRENCY = All.TLS_CONCURRENCY = concurrency
+    All.TEST_PORT = port
+    All.TEST_PORTS = None
+    All.TEST_TIMEOUT = timeout
+    All.PROBE_RATE = 0
+    All.SHARD_PROCESSES = 1
+    All.SAMPLES_PER_IP = 1
+    All.TLS_PROBE = True
+    All.TLS_CANDIDATES = len(targets)
+    All.TRACE_PROBE = False
+    All.HTTP_PINGS = 0
+    All.HISTORY_FILE = None
+    All.REGIONS = {}
+    tester = All.CloudflareNodeTester()
+    tester.nodes = set(targets)
+    start = time.perf_counter()
+    tester.test_all_nodes()
+    tester.tls_probe_nodes()
+    wall = time.perf_counter() - start
+    conn.send({
+        'wall_s': round(wall, 3),
+        'nodes': [(node['ip'], node['response_time_ms'], node.get('tls_time_ms'))
+                  for node in tester.ranker.sorted()],
+    })
+    conn.close()
+
+
+def average_ranks(values):
+    """秩次(从1开始)，相同的值取平均秩次"""
+    order = sorted(range(len(values)), key=values.__getitem__)
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+    return ranks
+
+
+def spearman(xs, ys):
+    """Spearman秩相关系数，样本不足或某一列全部相同时返回None"""
+    if len(xs) < 2:
+        return None
+    rx, ry = average_ranks(xs), average_ranks(ys)
+    mx, my = statistics.fmean(rx), statistics.fmean(ry)
+    cov = sum((a - mx) * (b - my) for a, b in zip(rx, ry))
+    vx = sum((a - mx) ** 2 for a in rx)
+    vy = sum((b - my) ** 2 for b in ry)
+    if not vx or not vy:
+        return None
+    return cov / (vx * vy) ** 0.5
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * q // 100) - 1)]
+
+
+def accuracy_report(nodes, delays, top, proxy_stats=None):
+    """比较测得值与注入延迟: TLS握手误差、TCP连接开销、Spearman相关系数和前N名重合率
+
+    proxy_stats为代理记录的 目标IP -> (后端响应毫秒, 代理转发滞后毫秒)，用于把TLS误差中
+    代理和后端自身的排队扣除，得到测试器一侧的误差。
+    """
+    measured = [(ip, connect, tls) for ip, connect, tls in nodes if tls is not None]
+    report = {'measured': len(measured), 'failed': len(delays) - len(measured)}
+    if not measured:
+        return report
+    injected = [delays[ip] for ip, _, _ in measured]
+    errors = [tls - delay for (_, _, tls), delay in zip(measured, injected)]
+    abs_errors = [abs(error) for error in errors]
+    connects = [connect for _, connect, _ in measured]
+    totals = [connect + tls for _, connect, tls in measured]  # 与rank_value一致: TCP连接 + TLS握手
+    report.update({
+        'tls_bias_ms': statistics.median(errors),
+        'tls_mae_ms': round(statistics.fmean(abs_errors), 2),
+        'tls_p95_abs_error_ms': percentile(abs_errors, 95),
+        'tls_max_abs_error_ms': max(abs_errors),
+        'connect_median_ms': statistics.median(connects),
+        'connect_p95_ms': percentile(connects, 95),
+        'connect_max_ms': max(connects),
+    })
+    # 误差归因: 测得值 = 注入延迟 + 后端响应 + 代理滞后 + 测试器一侧的开销
+    attributed = [(tls - delay, proxy_stats[ip]) for (ip, _, tls), delay in zip(measured, injected)
+                  if proxy_stats and ip in proxy_stats]
+    if attributed:
+        backend = [backend_ms for _, (backend_ms, _) in attributed]
+        lags = [lag_ms for _, (_, lag_ms) in attributed]
+        residuals = [error - backend_ms - lag_ms for error, (backend_ms, lag_ms) in attributed]
+        report.update({
+            'backend_median_ms': round(statistics.median(backend), 2),
+            'backend_p95_ms': round(percentile(backend, 95), 2),
+            'proxy_lag_median_ms': round(statistics.median(lags), 2),
+            'proxy_lag_p95_ms': round(percentile(lags, 95), 2),
+            'tester_bias_ms': round(statistics.median(residuals), 2),
+            'tester_mae_ms': round(statistics.fmean(abs(residual) for residual in residuals), 2),
+            'tester_p95_abs_error_ms': round(percentile([abs(residual) for residual in residuals], 95), 2),
+        })
+    rho = spearman(totals, injected)
+    report['spearman'] = round(rho, 4) if rho is not None else None
+    # 前N名重合率: 按测得值选出的前N个中，有多少属于注入延迟最低的前N个(延迟相同时按IP打破平局)
+    count = min(top, len(measured))
+    true_top = {ip for ip, _ in sorted(delays.items(), key=lambda item: (item[1], item[0]))[:count]}
+    measured_top = [ip for (ip, _, _), _ in sorted(zip(measured, totals), key=lambda item: item[1])[:count]]
+    report[f'top{top}_overlap'] = round(len(true_top.intersection(measured_top)) / count, 3)
+    return report
+
+
+def bench(engines, concurrency_levels, targets, delays, port, control, timeout, top, repeat=1, verbose=False):
+    """依次在独立子进程中运行各引擎和并发档位，返回精度结果列表；每次运行后从代理取回该次的统计"""
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for engine in engines:
+        for concurrency in concurrency_levels:
+            for run in range(repeat):
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=run_tester,
+                                          args=(sender, engine, concurrency, targets, port, timeout, verbose))
+                process.start()
+                sender.close()
+                result = {'engine': engine, 'concurrency': concurrency, 'run': run}
+                try:
+                    data = receiver.recv()
+                except EOFError:
+                    data = None
+                process.join()
+                control.send('stats')
+                proxy_stats = control.recv()
+                if data is None:
+                    result['error'] = f"子进程退出码 {process.exitcode}"
+                else:
+                    result['wall_s'] = data['wall_s']
+                    result.update(accuracy_report(data['nodes'], delays, top, proxy_stats))
+                results.append(result)
+                print(f"{engine:>9} 并发{concurrency:>5}: " + (
+                    result.get('error') or
+                    f"Spearman {result.get('spearman')}, 前{top}重合 {result.get(f'top{top}_overlap')}, "
+                    f"TLS平均误差 {result.get('tls_mae_ms')}ms(偏差 {result.get('tls_bias_ms')}ms, "
+                    f"其中后端 {result.get('backend_median_ms')}ms、代理滞后 {result.get('proxy_lag_median_ms')}ms、"
+                    f"测试器 {result.get('tester_bias_ms')}ms), "
+                    f"TCP连接中位数 {result.get('connect_median_ms')}ms, 失败 {result['failed']}"), file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量精度基准")
+    parser.add_argument('--engines', type=parse_list, default=BENCH_ENGINES, help="逗号分隔的引擎列表")
+    parser.add_argument('--concurrency', type=lambda text: parse_list(text, int), default=ACCURACY_CONCURRENCY,
+                        help="逗号分隔的并发档位")
+    parser.add_argument('--targets', type=int, default=ACCURACY_TARGETS, help="目标IP数")
+    parser.add_argument('--hosts-per-24', type=int, default=BENCH_HOSTS_PER_24, help="每个/24的目标数")
+    parser.add_argument('--max-delay', type=int, default=ACCURACY_MAX_DELAY, help="注入延迟上限(毫秒)")
+    parser.add_argument('--timeout', type=float, default=ACCURACY_TIMEOUT, help="探测超时(秒)")
+    parser.add_argument('--top', type=int, default=ACCURACY_TOP, help="计算前N名重合率时的N")
+    parser.add_argument('--repeat', type=int, default=1, help="每个组合重复的次数")
+    parser.add_argument('--seed', default="accuracy", help="分配注入延迟的随机种子")
+    parser.add_argument('--output', help="结果JSON文件，不指定时输出到标准输出")
+    parser.add_argument('--verbose', action='store_true', help="显示探测进度")
+    args = parser.parse_args(argv)
+
+    targets = bench_targets(args.targets, args.hosts_per_24)
+    rng = random.Random(args.seed)
+    delays = {ip: rng.randint(0, args.max_delay) for ip in targets}
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        control, proxy_control = context.Pipe()
+        proxy = context.Process(target=run_proxy, args=(delays, cert, key, proxy_control), daemon=True)
+        proxy.start()
+        proxy_control.close()
+        port = control.recv()
+        try:
+            results = bench(args.engines, args.concurrency, targets, delays, port, control, args.timeout,
+                            args.top, args.repeat, args.verbose)
+        finally:
+            proxy.terminate()
+            proxy.join()
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {
+            'targets': len(targets),
+            'hosts_per_24': args.hosts_per_24,
+            'max_delay_ms': args.max_delay,
+            'timeout_s': args.timeout,
+            'top': args.top,
+            'prefix_inflight': All.PREFIX_INFLIGHT,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""探测引擎性能基准
+
+在本机回环地址上启动一组监听端口(部分IP黑洞、可配置accept延迟)，用各探测引擎在不同并发下
+测试数千个目标，记录每秒探测数、CPU时间、峰值内存和耗时，结果以JSON输出，便于离线比较扫描吞吐是否退化。
+
+每次测试在独立的子进程中运行，CPU时间和峰值内存只统计探测本身。依赖Linux的127.0.0.0/8整段回环
+和SO_REUSEPORT。
+
+    python py/bench_engines.py --targets 5000 --concurrency 30,200,1000 --output bench.json
+"""
+import os
+import sys
+import time
+import json
+import random
+import socket
+import argparse
+import platform
+import selectors
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import All
+
+# 基准默认参数
+BENCH_ENGINES = ["thread", "asyncio", "selectors"]  # 参与比较的探测引擎
+BENCH_CONCURRENCY = [30, 200, 1000]  # 并发档位: thread引擎为MAX_THREADS，其余为MAX_CONCURRENCY
+BENCH_TARGETS = 5000        # 目标IP数
+BENCH_HOSTS_PER_24 = 9      # 每个/24的目标数，与扫描时的HOSTS_PER_24一致
+BENCH_BLACKHOLE = 0.05      # 黑洞IP比例(SYN被丢弃，直到超时)
+BENCH_ACCEPT_DELAY = 0.0    # 共享监听端口每次accept之间的延迟(毫秒)，模拟繁忙的服务端
+BENCH_BACKLOG = 4096        # 共享监听端口的backlog，accept跟不上时队列满会丢SYN
+BENCH_TIMEOUT = 1.0         # 探测超时(秒)，决定黑洞IP的耗时
+
+
+def bench_targets(count, hosts_per_24):
+    """生成分布在多个/24中的回环目标: 127.x.y.1 ~ 127.x.y.hosts_per_24"""
+    hosts_per_24 = max(1, min(254, hosts_per_24))
+    targets = []
+    for i in range(count):
+        network, host = divmod(i, hosts_per_24)
+        targets.append(f"127.{1 + network // 256}.{network % 256}.{1 + host}")
+    return targets
+
+
+class ListenerFarm:
+    """回环监听端口集合: 一个绑定0.0.0.0的共享监听端口响应所有目标，黑洞IP在同一端口上绑定
+    backlog为0且从不accept的监听(内核优先匹配具体地址)，并预先占满其队列，之后的SYN都会被丢弃
+    """
+
+    def __init__(self, blackholes=(), accept_delay=0.0, backlog=BENCH_BACKLOG):
+        self.accept_delay = accept_delay / 1000
+        self.listener = self.listen('0.0.0.0', 0, backlog)
+        self.port = self.listener.getsockname()[1]
+        self.sockets = []
+        for ip in blackholes:
+            sock = self.listen(ip, self.port, 0)
+            filler = socket.create_connection((ip, self.port), timeout=1)
+            self.sockets.extend((sock, filler))
+        self.accepted = 0
+        self.stopping = False
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    @staticmethod
+    def listen(ip, port, backlog):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((ip, port))
+        sock.listen(backlog)
+        sock.setblocking(False)
+        return sock
+
+    def serve(self):
+        """accept后立即关闭连接；有accept延迟时每次accept后暂停监听一段时间"""
+        selector = selectors.DefaultSelector()
+        selector.register(self.listener, selectors.EVENT_READ)
+        paused_until = None
+        while not self.stopping:
+            if paused_until is not None:
+                wait = paused_until - time.monotonic()
+                if wait > 0:
+                    time.sleep(min(wait, 0.1))
+                    continue
+                paused_until = None
+                selector.register(self.listener, selectors.EVENT_READ)
+            if not selector.select(0.1):
+                continue
+            while True:
+                try:
+                    conn, _ = self.listener.accept()
+                except (BlockingIOError, InterruptedError):
+                    break
+                conn.close()
+                self.accepted += 1
+                if self.accept_delay:
+                    selector.unregister(self.listener)
+                    paused_until = time.monotonic() + self.accept_delay
+                    break
+        selector.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopping = True
+        self.thread.join()
+        for sock in [self.listener] + self.sockets:
+            sock.close()
+
+
+def cpu_seconds():
+    """当前进程(含所有线程)已用的用户态+内核态CPU秒数，以及峰值内存(MB)"""
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024
+
+
+def run_engine(conn, engine, concurrency, targets, port, timeout, verbose):
+    """子进程: 用指定引擎和并发测试全部目标，把统计结果发回父进程"""
+    if not verbose:
+        sys.stderr = open(os.devnull, 'w')  # 探测进度打印到stderr，基准时丢弃
+    All.PROBE_ENGINE = engine
+    All.MAX_THREADS = All.MAX_CONCURRENCY = concurrency
+    All.TEST_PORT = port
+    All.TEST_PORTS = None
+    All.TEST_TIMEOUT = timeout
+    All.PROBE_RATE = 0
+    All.SHARD_PROCESSES = 1
+    All.SAMPLES_PER_IP = 1
+    All.HISTORY_FILE = None
+    All.REGIONS = {}
+    tester = All.CloudflareNodeTester()
+    tester.nodes = set(targets)
+
+    cpu_start, rss_start = cpu_seconds()
+    start = time.perf_counter()
+    tester.test_all_nodes()
+    wall = time.perf_counter() - start
+    cpu_end, rss_peak = cpu_seconds()
+
+    probes = len(tester.store)
+    conn.send({
+        'engine': engine,
+        'concurrency': concurrency,
+        'targets': len(targets),
+        'probes': probes,
+        'reachable': tester.ranker.reachable,
+        'unreachable': tester.ranker.unreachable,
+        'wall_s': round(wall, 3),
+        'probes_per_s': round(probes / wall, 1) if wall else None,
+        'cpu_s': round(cpu_end - cpu_start, 3),
+        'cpu_us_per_probe': round((cpu_end - cpu_start) * 1e6 / probes, 1) if probes else None,
+        'peak_rss_mb': round(rss_peak, 1),
+        'rss_growth_mb': round(rss_peak - rss_start, 1),
+    })
+    conn.close()
+
+
+def bench(engines, concurrency_levels, targets, port, timeout, repeat=1, verbose=False):
+    """依次在独立子进程中运行各引擎和并发档位，返回结果列表"""
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for engine in engines:
+        for concurrency in concurrency_levels:
+            for run in range(repeat):
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=run_engine,
+                                          args=(sender, engine, concurrency, targets, port, timeout, verbose))
+                process.start()
+                sender.close()
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    result = {'engine': engine, 'concurrency': concurrency, 'error': f"子进程退出码 {process.exitcode}"}
+                process.join()
+                result['run'] = run
+                results.append(result)
+                print(f"{engine:>9} 并发{concurrency:>5}: " + (
+                    result.get('error') or
+                    f"{result['probes_per_s']} 次/秒, CPU {result['cpu_s']}s, "
+                    f"峰值内存 {result['peak_rss_mb']}MB, 耗时 {result['wall_s']}s, "
+                    f"可达 {result['reachable']}/{result['targets']}"), file=sys.stderr)
+    return results
+
+
+def parse_list(text, cast=str):
+    return [cast(item) for item in text.split(',') if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="探测引擎性能基准")
+    parser.add_argument('--engines', type=parse_list, default=BENCH_ENGINES, help="逗号分隔的引擎列表")
+    parser.add_argument('--concurrency', type=lambda text: parse_list(text, int), default=BENCH_CONCURRENCY,
+                        help="逗号分隔的并发档位")
+    parser.add_argument('--targets', type=int, default=BENCH_TARGETS, help="目标IP数")
+    parser.add_argument('--hosts-per-24', type=int, default=BENCH_HOSTS_PER_24, help="每个/24的目标数")
+    parser.add_argument('--blackhole', type=float, default=BENCH_BLACKHOLE, help="黑洞IP比例")
+    parser.add_argument('--accept-delay', type=float, default=BENCH_ACCEPT_DELAY, help="每次accept之间的延迟(毫秒)")
+    parser.add_argument('--backlog', type=int, default=BENCH_BACKLOG, help="共享监听端口的backlog")
+    parser.add_argument('--timeout', type=float, default=BENCH_TIMEOUT, help="探测超时(秒)")
+    parser.add_argument('--repeat', type=int, default=1, help="每个组合重复的次数")
+    parser.add_argument('--seed', default="bench", help="选择黑洞IP的随机种子")
+    parser.add_argument('--output', help="结果JSON文件，不指定时输出到标准输出")
+    parser.add_argument('--verbose', action='store_true', help="显示探测进度")
+    args = parser.parse_args(argv)
+
+    targets = bench_targets(args.targets, args.hosts_per_24)
+    blackholes = random.Random(args.seed).sample(targets, int(len(targets) * args.blackhole))
+    All.raise_nofile_limit(2 * len(blackholes) + 64)
+
+    with ListenerFarm(blackholes, args.accept_delay, args.backlog) as farm:
+        results = bench(args.engines, args.concurrency, targets, farm.port, args.timeout,
+                        args.repeat, args.verbose)
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {
+            'targets': len(targets),
+            'hosts_per_24': args.hosts_per_24,
+            'blackholes': len(blackholes),
+            'accept_delay_ms': args.accept_delay,
+            'backlog': args.backlog,
+            'timeout_s': args.timeout,
+            'prefix_inflight': All.PREFIX_INFLIGHT,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Cloudflare网段索引
+
+把网段列表合并去重为最少的CIDR，编译成有序的整数区间数组，用二分查找做O(log n)的
+归属判断和所属网段查询。编译结果缓存在网段文件旁的二进制文件(.idx)中，网段文件未变化时直接加载。
+"""
+import os
+import sys
+import socket
+import struct
+import bisect
+import ipaddress
+from array import array
+
+# 仓库根目录
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLOUDFLARE_RANGES = os.path.join(REPO_DIR, "ip", "cloudflare-ranges.txt")  # Cloudflare公布的全部网段
+
+SIDECAR_MAGIC = b"CFPIDX1\0"
+SIDECAR_HEADER = struct.Struct("<8sqqII")  # 标识, 网段文件大小, 网段文件修改时间(ns), IPv4区间数, IPv6区间数
+
+
+def parse_prefixes(lines):
+    """解析网段文本，每行一个CIDR或IP，忽略空行和#注释，返回ip_network列表"""
+    networks = []
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(line, strict=False))
+        except ValueError:
+            print(f"无效的网段: {line}", file=sys.stderr)
+    return networks
+
+
+class PrefixIndex:
+    """合并后的网段索引: IPv4和IPv6分别保存为按起始地址排序、互不重叠的[起始, 结束]区间"""
+
+    def __init__(self, prefixes=()):
+        """prefixes为CIDR字符串或ip_network，重叠和相邻的网段会合并为最少的CIDR，无效的网段跳过"""
+        prefixes = list(prefixes)
+        networks = [p for p in prefixes if not isinstance(p, str)]
+        networks += parse_prefixes(p for p in prefixes if isinstance(p, str))
+        self.v4_starts = array('I')
+        self.v4_ends = array('I')
+        self.v6_starts = []
+        self.v6_ends = []
+        for version, starts, ends in ((4, self.v4_starts, self.v4_ends), (6, self.v6_starts, self.v6_ends)):
+            for network in ipaddress.collapse_addresses(n for n in networks if n.version == version):
+                starts.append(int(network.network_address))
+                ends.append(int(network.broadcast_address))
+
+    @classmethod
+    def load(cls, path, cache=True):
+        """从网段文件加载，优先读取未过期的二进制缓存，否则解析后写入缓存"""
+        stat = os.stat(path)
+        sidecar = path + '.idx'
+        if cache:
+            index = cls.read_sidecar(sidecar, stat)
+            if index is not None:
+                return index
+        with open(path, 'r', encoding='utf-8') as f:
+            index = cls(parse_prefixes(f))
+        if cache:
+            index.write_sidecar(sidecar, stat)
+        return index
+
+    @classmethod
+    def read_sidecar(cls, sidecar, stat):
+        """读取二进制缓存，缓存不存在、格式不对或与网段文件不一致时返回None"""
+        try:
+            with open(sidecar, 'rb') as f:
+                data = f.read()
+            magic, size, mtime, n4, n6 = SIDECAR_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+        if magic != SIDECAR_MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns:
+            return None
+        if len(data) != SIDECAR_HEADER.size + n4 * 8 + n6 * 32:
+            return None
+        index = cls()
+        offset = SIDECAR_HEADER.size
+        index.v4_starts.frombytes(data[offset:offset + n4 * 4])
+        index.v4_ends.frombytes(data[offset + n4 * 4:offset + n4 * 8])
+        if sys.byteorder == 'big':  # 缓存文件统一为小端
+            index.v4_starts.byteswap()
+            index.v4_ends.byteswap()
+        offset += n4 * 8
+        for i in range(n6):
+            pos = offset + i * 32
+            index.v6_starts.append(int.from_bytes(data[pos:pos + 16], 'big'))
+            index.v6_ends.append(int.from_bytes(data[pos + 16:pos + 32], 'big'))
+        return index
+
+    def write_sidecar(self, sidecar, stat):
+        """写入二进制缓存(先写临时文件再替换)，失败时只打印提示"""
+        starts, ends = array('I', self.v4_starts), array('I', self.v4_ends)
+        if sys.byteorder == 'big':
+            starts.byteswap()
+            ends.byteswap()
+        parts = [SIDECAR_HEADER.pack(SIDECAR_MAGIC, stat.st_size, stat.st_mtime_ns,
+                                     len(self.v4_starts), len(self.v6_starts)),
+                 starts.tobytes(), ends.tobytes()]
+        for start, end in zip(self.v6_starts, self.v6_ends):
+            parts.append(start.to_bytes(16, 'big') + end.to_bytes(16, 'big'))
+        tmp_path = sidecar + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(parts))
+            os.replace(tmp_path, sidecar)
+        except OSError as e:
+            print(f"写入网段缓存失败: {e}", file=sys.stderr)
+
+    def find(self, ip):
+        """返回IP所在区间的(版本, 序号)，不属于任何网段时返回None"""
+        try:
+            value, version = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big'), 4
+        except OSError:
+            try:
+                value, version = int(ipaddress.IPv6Address(ip)), 6
+            except ValueError:
+                return None
+        return self.find_value(value, version)
+
+    def find_value(self, value, version=4):
+        """按整数地址查找，返回所在区间的(版本, 序号)，不属于任何网段时返回None"""
+        starts, ends = (self.v4_starts, self.v4_ends) if version == 4 else (self.v6_starts, self.v6_ends)
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return version, i
+        return None
+
+    def contains(self, ip):
+        """IP是否属于索引中的网段"""
+        return self.find(ip) is not None
+
+    def prefix_of(self, ip):
+        """返回IP所属的合并后CIDR，不属于任何网段时返回None"""
+        found = self.find(ip)
+        if found is None:
+            return None
+        version, i = found
+        if version == 4:
+            return self.network(4, self.v4_starts[i], self.v4_ends[i])
+        return self.network(6, self.v6_starts[i], self.v6_ends[i])
+
+    @staticmethod
+    def network(version, start, end):
+        """由区间起止整数构造CIDR(区间总是一个完整的CIDR)"""
+        network_class, bits = (ipaddress.IPv4Network, 32) if version == 4 else (ipaddress.IPv6Network, 128)
+        return network_class((start, bits - (end - start + 1).bit_length() + 1))
+
+    def networks(self):
+        """按地址顺序返回合并后的全部CIDR(先IPv4后IPv6)"""
+        result = [self.network(4, s, e) for s, e in zip(self.v4_starts, self.v4_ends)]
+        result += [self.network(6, s, e) for s, e in zip(self.v6_starts, self.v6_ends)]
+        return result
+
+    def __len__(self):
+        return len(self.v4_starts) + len(self.v6_starts)
+
+
+CLOUDFLARE_INDEX = None  # 首次使用时加载
+
+
+def is_cloudflare(ip):
+    """IP是否属于Cloudflare公布的网段"""
+    global CLOUDFLARE_INDEX
+    if CLOUDFLARE_INDEX is None:
+        CLOUDFLARE_INDEX = PrefixIndex.load(CLOUDFLARE_RANGES)
+    return CLOUDFLARE_INDEX.contains(ip)
+
+
+if __name__ == "__main__":
+    # 输出合并后的网段: python py/cfprefix.py [网段文件]
+    index = PrefixIndex.load(sys.argv[1] if len(sys.argv) > 1 else CLOUDFLARE_RANGES)
+    for network in index.networks():
+        print(network)
+    print(f"合并后共 {len(index)} 个网段", file=sys.stderr)